@@ -0,0 +1,3 @@
+"""Load benchmark for the auth and post hot paths.
+
+Run with ``python -m bench --help`` against a dedicated database."""
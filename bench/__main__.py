@@ -0,0 +1,130 @@
+"""Benchmark of the auth and post hot paths.
+
+    python -m bench --users 20 --posts 5000 --concurrency 16 --requests 500
+
+Boots src.main:app in-process against the Postgres from the DB_* settings
+and a fakeredis stand-in (--redis local uses REDIS_* instead). Point DB_*
+at a throwaway database with the migrations applied: bench_* users and
+their posts are created before the run and removed after it.
+
+Every scenario runs the same number of requests at a fixed concurrency and
+the report is printed as JSON, tagged with the current git commit, so runs
+on different commits can be compared directly.
+
+--check-budgets also holds every request to the SQL and Redis budget of
+its route (src.budgets), prints the offenders with their statements and
+exits with status 1 when there are any."""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# The login limiter stays in the measured path but must never trip; set
+# before anything below imports src.config
+os.environ.setdefault("LOGIN_RATE_PER_IP", str(10 ** 9))
+os.environ.setdefault("LOGIN_RATE_PER_USERNAME", str(10 ** 9))
+
+from bench.runner import SCENARIOS  # noqa: E402
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500,
+                        help="requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma separated subset of "
+                             + ", ".join(SCENARIOS))
+    parser.add_argument("--redis", choices=("fake", "local"), default="fake")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the random post picks")
+    parser.add_argument("--output", help="write the report here too")
+    parser.add_argument("--check-budgets", action="store_true",
+                        help="fail on requests over their query budget")
+    return parser.parse_args(argv)
+
+
+def use_fake_redis() -> None:
+    """Swaps the Redis client before anything imports it"""
+    # fakeredis does not import its aioredis submodule on every version
+    from fakeredis import aioredis
+    import src.redisdata as redisdata
+    from src.metrics import InstrumentedRedis
+    redisdata.pool = aioredis.FakeRedis().connection_pool
+    redisdata.connect = InstrumentedRedis(connection_pool=redisdata.pool)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    if args.redis == "fake":
+        use_fake_redis()
+    from src.main import app
+    from src.budgets import budget_checker
+    from bench.runner import Bench
+    from bench.seed import cleanup, seed
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    budget_checker.enabled = budget_checker.enabled or args.check_budgets
+    results = {}
+    async with app.router.lifespan_context(app):
+        await cleanup()
+        seeded = await seed(
+            users=args.users, posts=args.posts,
+            spare_per_user=args.requests if "delete" in scenarios else 0)
+        try:
+            async with Bench(app, seeded, concurrency=args.concurrency,
+                             requests=args.requests,
+                             seed=args.seed) as bench:
+                for name in scenarios:
+                    results[name] = await bench.run(name)
+        finally:
+            await cleanup()
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "users": args.users,
+            "posts": args.posts,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "redis": args.redis,
+        },
+        "results": results,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    sys.stdout.write(report + "\n")
+    if args.check_budgets:
+        from src.budgets import budget_checker
+        if budget_checker.offenders:
+            sys.stderr.write("Requests over their query budget:\n"
+                             + budget_checker.report() + "\n")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
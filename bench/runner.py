@@ -0,0 +1,117 @@
+import asyncio
+import itertools
+import random
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+from bench.seed import Seeded, PASSWORD
+from bench.stats import summarize
+
+SCENARIOS = ("login", "refresh", "list", "summary", "revalidate_list",
+             "get", "revalidate", "edit", "delete")
+
+
+class Worker:
+    """One logged-in client, used by a single task at a time so the
+    refresh-token rotation of one request never races another"""
+
+    def __init__(self, client: httpx.AsyncClient, user_id: int,
+                 username: str):
+        self.client = client
+        self.user_id = user_id
+        self.username = username
+        # Last ETag seen per URL, sent back as If-None-Match
+        self.etags: dict[str, str] = {}
+
+    async def revalidate(self, url: str, **params) -> httpx.Response:
+        """Conditional GET: the first request of a URL sends a stale tag,
+        so the miss path is measured along with the 304s"""
+        response = await self.client.get(url, params=params, headers={
+            "If-None-Match": self.etags.get(url, '"stale"')})
+        if "ETag" in response.headers:
+            self.etags[url] = response.headers["ETag"]
+        return response
+
+
+class Bench:
+    def __init__(self, app, seeded: Seeded, concurrency: int,
+                 requests: int, seed: int = 0):
+        self.app = app
+        self.seeded = seeded
+        self.concurrency = concurrency
+        self.requests = requests
+        self.random = random.Random(seed)
+        self.workers: list[Worker] = []
+
+    async def __aenter__(self) -> "Bench":
+        for index in range(self.concurrency):
+            user_id, username = self.seeded.users[
+                index % len(self.seeded.users)]
+            client = httpx.AsyncClient(app=self.app, base_url="http://bench")
+            response = await client.post("/auth/login", params={
+                "username": username, "password": PASSWORD})
+            response.raise_for_status()
+            self.workers.append(Worker(client, user_id, username))
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        for worker in self.workers:
+            await worker.client.aclose()
+
+    async def scenario_login(self, worker: Worker) -> httpx.Response:
+        return await worker.client.post("/auth/login", params={
+            "username": worker.username, "password": PASSWORD})
+
+    async def scenario_refresh(self, worker: Worker) -> httpx.Response:
+        worker.client.cookies.delete("access_token")
+        return await worker.client.get("/tasks", params={"limit": 1})
+
+    async def scenario_list(self, worker: Worker) -> httpx.Response:
+        return await worker.client.get("/tasks", params={"limit": 50})
+
+    async def scenario_summary(self, worker: Worker) -> httpx.Response:
+        return await worker.client.get("/tasks", params={"limit": 50,
+                                                         "view": "summary"})
+
+    async def scenario_revalidate_list(self, worker: Worker) \
+            -> httpx.Response:
+        return await worker.revalidate("/tasks", limit=50, author="me")
+
+    async def scenario_get(self, worker: Worker) -> httpx.Response:
+        post_id = self.random.choice(self.seeded.posts)
+        return await worker.client.get(f"/tasks/{post_id}")
+
+    async def scenario_revalidate(self, worker: Worker) -> httpx.Response:
+        post_id = self.random.choice(self.seeded.posts)
+        return await worker.revalidate(f"/tasks/{post_id}")
+
+    async def scenario_edit(self, worker: Worker) -> httpx.Response:
+        post_id = self.random.choice(self.seeded.own_posts[worker.user_id])
+        return await worker.client.put(f"/tasks/{post_id}", json={
+            "title": "bench edit", "text": f"edited {time.time()}"})
+
+    async def scenario_delete(self, worker: Worker) -> httpx.Response:
+        post_id = self.seeded.spare_posts[worker.user_id].pop()
+        return await worker.client.delete(f"/tasks/{post_id}")
+
+    async def run(self, name: str) -> dict:
+        operation: Callable[[Worker], Awaitable[httpx.Response]] = \
+            getattr(self, f"scenario_{name}")
+        latencies: list[float] = []
+        errors = 0
+        counter = itertools.count()
+
+        async def drive(worker: Worker) -> None:
+            nonlocal errors
+            while next(counter) < self.requests:
+                start = time.perf_counter()
+                response = await operation(worker)
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(drive(worker) for worker in self.workers))
+        return summarize(latencies, errors, time.perf_counter() - start)
@@ -0,0 +1,88 @@
+from dataclasses import dataclass, field
+
+from sqlalchemy import delete, insert, select
+
+from src.database import async_session_maker
+from src.post.models import Post, PostTombstone
+from src.user.models import User
+from src.security import Hasher
+
+PREFIX = "bench_"
+PASSWORD = "bench-password"
+TEXT = "Dear diary, today the benchmark ran again. " * 20
+CHUNK = 1000
+
+
+@dataclass
+class Seeded:
+    users: list[tuple[int, str]]
+    posts: list[int]
+    own_posts: dict[int, list[int]] = field(default_factory=dict)
+    spare_posts: dict[int, list[int]] = field(default_factory=dict)
+
+
+async def cleanup() -> None:
+    """Removes everything a previous run left behind"""
+    # Imported here so the cache binds to the Redis client the bench
+    # may have swapped in
+    from src.authorization.cache import UserLookupCache
+    async with async_session_maker() as session, session.begin():
+        bench_users = (select(User.id)
+                       .where(User.username.startswith(PREFIX))
+                       .scalar_subquery())
+        await session.execute(delete(Post)
+                              .where(Post.author_id.in_(bench_users)))
+        await session.execute(delete(PostTombstone)
+                              .where(PostTombstone.author_id
+                                     .in_(bench_users)))
+        removed = await session.scalars(
+            delete(User)
+            .where(User.username.startswith(PREFIX))
+            .returning(User.username))
+        usernames = removed.all()
+    # The next run registers the same names under new ids
+    await UserLookupCache().forget(*usernames)
+
+
+async def _insert_posts(session, rows: list[dict]) -> list[tuple[int, int]]:
+    result = []
+    for start in range(0, len(rows), CHUNK):
+        chunk = await session.execute(
+            insert(Post).returning(Post.id, Post.author_id,
+                                   sort_by_parameter_order=True),
+            rows[start:start + CHUNK])
+        result.extend(chunk.all())
+    return result
+
+
+async def seed(users: int, posts: int, spare_per_user: int) -> Seeded:
+    """Creates bench users and posts. Spare posts are kept apart so the
+    delete scenario never removes posts the other scenarios read"""
+    password = Hasher.get_hash_password(PASSWORD)
+    async with async_session_maker() as session, session.begin():
+        result = await session.execute(
+            insert(User).returning(User.id, User.username,
+                                   sort_by_parameter_order=True),
+            [{"email": f"{PREFIX}{i}@bench.local",
+              "username": f"{PREFIX}{i}",
+              "password": password,
+              "is_admin": False,
+              "is_active": True} for i in range(users)])
+        user_rows = [tuple(row) for row in result.all()]
+        seeded = Seeded(users=user_rows, posts=[])
+        for user_id, _ in user_rows:
+            seeded.own_posts[user_id] = []
+            seeded.spare_posts[user_id] = []
+        rows = await _insert_posts(session, [
+            {"title": f"bench post {i}", "text": TEXT,
+             "author_id": user_rows[i % users][0]}
+            for i in range(posts)])
+        for post_id, author_id in rows:
+            seeded.posts.append(post_id)
+            seeded.own_posts[author_id].append(post_id)
+        rows = await _insert_posts(session, [
+            {"title": "bench spare post", "text": TEXT, "author_id": user_id}
+            for user_id, _ in user_rows for _ in range(spare_per_user)])
+        for post_id, author_id in rows:
+            seeded.spare_posts[author_id].append(post_id)
+    return seeded
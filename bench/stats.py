@@ -0,0 +1,22 @@
+import math
+
+
+def percentile(samples: list[float], percent: float) -> float:
+    """Nearest-rank percentile of already sorted samples"""
+    if not samples:
+        return 0.0
+    rank = max(math.ceil(percent / 100 * len(samples)), 1)
+    return samples[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    samples = sorted(latencies)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "req_per_sec": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3) if samples else 0.0,
+    }
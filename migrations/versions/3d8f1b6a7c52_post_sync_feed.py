@@ -0,0 +1,48 @@
+"""post sync feed
+
+Revision ID: 3d8f1b6a7c52
+Revises: e7a2c9b4d013
+Create Date: 2026-10-18 18:31:50.216604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d8f1b6a7c52'
+down_revision = 'e7a2c9b4d013'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('created_at',
+                                     sa.DateTime(timezone=True),
+                                     server_default=sa.text('now()'),
+                                     nullable=False))
+    op.add_column('posts', sa.Column('updated_at',
+                                     sa.DateTime(timezone=True),
+                                     server_default=sa.text('now()'),
+                                     nullable=False))
+    op.create_index('ix_posts_author_id_updated_at', 'posts',
+                    ['author_id', 'updated_at', 'id'], unique=False)
+    op.create_table('post_tombstones',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(timezone=True),
+                  server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('post_id')
+    )
+    op.create_index('ix_post_tombstones_author_id_deleted_at',
+                    'post_tombstones', ['author_id', 'deleted_at', 'post_id'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_post_tombstones_author_id_deleted_at',
+                  table_name='post_tombstones')
+    op.drop_table('post_tombstones')
+    op.drop_index('ix_posts_author_id_updated_at', table_name='posts')
+    op.drop_column('posts', 'updated_at')
+    op.drop_column('posts', 'created_at')
@@ -0,0 +1,34 @@
+"""post search vector
+
+Revision ID: 5b0d3e1f9a27
+Revises: 86e6944b3e42
+Create Date: 2026-10-18 12:10:02.118345
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5b0d3e1f9a27'
+down_revision = '86e6944b3e42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("setweight(to_tsvector('simple', title), 'A') || "
+                    "setweight(to_tsvector('simple', text), 'B')",
+                    persisted=True),
+        nullable=True))
+    op.create_index('ix_posts_search_vector', 'posts', ['search_vector'],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_search_vector', table_name='posts',
+                  postgresql_using='gin')
+    op.drop_column('posts', 'search_vector')
@@ -0,0 +1,26 @@
+"""tombstone retention
+
+Revision ID: 9a4c2e7f1b38
+Revises: 3d8f1b6a7c52
+Create Date: 2026-10-18 21:12:40.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c2e7f1b38'
+down_revision = '3d8f1b6a7c52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_post_tombstones_deleted_at', 'post_tombstones',
+                    ['deleted_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_post_tombstones_deleted_at',
+                  table_name='post_tombstones')
@@ -0,0 +1,25 @@
+"""post version
+
+Revision ID: c41f7a9d2e10
+Revises: 5b0d3e1f9a27
+Create Date: 2026-10-18 15:42:37.503112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f7a9d2e10'
+down_revision = '5b0d3e1f9a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('version', sa.Integer(),
+                                     server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('posts', 'version')
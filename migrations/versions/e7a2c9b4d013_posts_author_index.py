@@ -0,0 +1,25 @@
+"""posts author index
+
+Revision ID: e7a2c9b4d013
+Revises: c41f7a9d2e10
+Create Date: 2026-10-18 17:05:12.840271
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c9b4d013'
+down_revision = 'c41f7a9d2e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_posts_author_id_id', 'posts',
+                    ['author_id', sa.text('id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_posts_author_id_id', table_name='posts')
@@ -0,0 +1,157 @@
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from logging import getLogger
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.config import USER_CACHE_TTL, USER_CACHE_MISS_TTL
+from src.config import USER_CACHE_LOCAL_TTL, USER_CACHE_LOCAL_SIZE
+from src.redisdata import connect as redis_session
+from src.metrics import registry, StatsCollector
+
+logger = getLogger(__name__)
+
+# Stored for a username that does not exist
+MISSING = ""
+
+
+@dataclass(frozen=True)
+class UserRecord:
+    """What a login needs to know about a user"""
+    id: int
+    username: str
+    email: str
+    password: str
+    is_active: bool | None
+    is_admin: bool | None
+
+    @staticmethod
+    def of(user) -> "UserRecord":
+        return UserRecord(id=user.id, username=user.username,
+                          email=user.email, password=user.password,
+                          is_active=user.is_active, is_admin=user.is_admin)
+
+
+class UserCacheStats:
+    """Per-process counters of the user lookup cache"""
+
+    def __init__(self):
+        self.local_hits = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class UserLookupCache:
+    """Username to UserRecord, in a short-lived per-worker LRU in front
+    of Redis. Unknown usernames are cached as well.
+
+    Loads from the database only fill an empty key (SET NX), while
+    registration and deactivation overwrite it, so a load that raced
+    with either of them never replaces the newer record"""
+
+    stats = UserCacheStats()
+    local: OrderedDict[str, tuple[UserRecord | None, float]] = OrderedDict()
+    prefix = "user:name:"
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
+
+    @staticmethod
+    def entry_key(username: str) -> str:
+        return f"{UserLookupCache.prefix}{username}"
+
+    @staticmethod
+    def _remember(username: str, record: UserRecord | None) -> None:
+        if USER_CACHE_LOCAL_TTL <= 0:
+            return
+        local = UserLookupCache.local
+        local[username] = (record, time.monotonic() + USER_CACHE_LOCAL_TTL)
+        local.move_to_end(username)
+        if len(local) > USER_CACHE_LOCAL_SIZE:
+            local.popitem(last=False)
+
+    @staticmethod
+    def _recall(username: str) -> tuple[bool, UserRecord | None]:
+        entry = UserLookupCache.local.get(username)
+        if entry is None:
+            return False, None
+        record, expire = entry
+        if expire <= time.monotonic():
+            del UserLookupCache.local[username]
+            return False, None
+        UserLookupCache.local.move_to_end(username)
+        return True, record
+
+    async def get(self, username: str) -> tuple[bool, UserRecord | None]:
+        """(found, record): a found None is a cached unknown username"""
+        found, record = self._recall(username)
+        if found:
+            self.stats.local_hits += 1
+            return True, record
+        try:
+            data = await self.database.get(self.entry_key(username))
+        except RedisError as err:
+            self.stats.errors += 1
+            logger.error(err)
+            return False, None
+        if data is None:
+            self.stats.misses += 1
+            return False, None
+        if data.decode() == MISSING:
+            self.stats.negative_hits += 1
+            record = None
+        else:
+            self.stats.hits += 1
+            record = UserRecord(**json.loads(data))
+        self._remember(username, record)
+        return True, record
+
+    async def fill(self, username: str, record: UserRecord | None) -> None:
+        """Caches what the database returned, unless a newer write
+        already did"""
+        self._remember(username, record)
+        await self._set(username, record, nx=True)
+
+    async def put(self, record: UserRecord) -> None:
+        """Writes the record through after the user has changed"""
+        self.local.pop(record.username, None)
+        await self._set(record.username, record, nx=False)
+
+    async def forget(self, *usernames: str) -> None:
+        """Drops the entries of users removed outside the app"""
+        for username in usernames:
+            self.local.pop(username, None)
+        if not usernames:
+            return None
+        try:
+            await self.database.delete(*map(self.entry_key, usernames))
+        except RedisError as err:
+            self.stats.errors += 1
+            logger.error(err)
+
+    async def _set(self, username: str, record: UserRecord | None,
+                   nx: bool) -> None:
+        if record is None:
+            value, ttl = MISSING, USER_CACHE_MISS_TTL
+        else:
+            value, ttl = json.dumps(asdict(record)), USER_CACHE_TTL
+        try:
+            await self.database.set(self.entry_key(username), value,
+                                    ex=ttl, nx=nx)
+            self.stats.writes += 1
+        except RedisError as err:
+            self.stats.errors += 1
+            logger.error(err)
+
+
+registry.register(StatsCollector("user_cache", "User lookup cache",
+                                 lambda: UserLookupCache.stats.as_dict()))
@@ -1,21 +1,30 @@
-from datetime import datetime, timedelta
-from typing import Any
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 import json
+import secrets
+import time
+from typing import Any
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from fastapi import HTTPException, Request
-from fastapi.responses import JSONResponse
-from jose import jwt, JWSError
-from redis import Redis
+from fastapi.responses import JSONResponse, Response
+from jose import jwt, JWTError
+from redis.asyncio import Redis
 
 from src.user.models import User
 from src.user.schemas import UserGet
 from src.security import Hasher
-from src.config import ALGORITHM, SECRET_KEY
-from src.config import ACCESS_TOKEN_EXPIRE_MINUTES
+from src.config import ACCESS_TOKEN_EXPIRE_MINUTES, TOKEN_CACHE_SIZE
+from src.config import REFRESH_TOKEN_EXPIRE_DAYS, REFRESH_GRACE_SECONDS
 from src.authorization.schemas import TokenData
-from src.redisdata import connect as redis_session
+from src.authorization.cache import UserLookupCache, UserRecord
+from src.authorization.keys import key_ring
+from src.redisdata import connect as redis_session, lua
+from src.responses import FastJSONResponse
+
+ACCESS_TOKEN_EXPIRE = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+REFRESH_TOKEN_EXPIRE = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
 
 
 class AuthDB:
@@ -24,9 +33,16 @@ class AuthDB:
     def __init__(self, session: AsyncSession):
         self.session = session
 
-    async def get_user_by_username(self, username: str) -> User | None:
-        stmt = select(User).where(User.username == username)
-        result = await self.session.scalar(stmt)
+    async def get_user_by_username(self, username: str) -> UserRecord:
+        """Looks the user up through UserLookupCache, so neither repeated
+        logins nor unknown usernames reach the database every time"""
+        cache = UserLookupCache()
+        found, result = await cache.get(username)
+        if not found:
+            stmt = select(User).where(User.username == username)
+            user = await self.session.scalar(stmt)
+            result = UserRecord.of(user) if user else None
+            await cache.fill(username, result)
         if result:
             return result
         else:
@@ -37,30 +53,165 @@ class AuthDB:
             })
 
 
+# Swap a refresh token for a new one atomically. The old token then
+# maps to the new pair for a grace window, so requests racing with the
+# rotation on the same cookie get that pair rather than a 401
+ROTATE_SCRIPT = lua("""
+local body = redis.call('GET', KEYS[1])
+if not body then
+    local successor = redis.call('GET', KEYS[4])
+    if not successor then
+        return false
+    end
+    return cjson.decode(successor)
+end
+redis.call('DEL', KEYS[1])
+redis.call('SET', KEYS[2], body, 'EX', ARGV[3])
+redis.call('SREM', KEYS[3], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[2])
+redis.call('EXPIRE', KEYS[3], ARGV[3])
+if tonumber(ARGV[4]) > 0 then
+    redis.call('SET', KEYS[4], cjson.encode({ARGV[2], body}),
+               'EX', ARGV[4])
+end
+return {ARGV[2], body}
+""")
+
+
 class AuthRedis:
-    """Class created for interaction methods of RedisDataBase"""
+    """Class created for interaction methods of RedisDataBase.
+
+    A refresh token is "<user id>.<random>", so the per-user session
+    index can be found from the token alone"""
+
+    prefix = "refresh:"
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
 
-    def __init__(self, session: Redis):
-        self.database = redis_session
+    @staticmethod
+    def new_refresh_token(user_id: int) -> str:
+        return f"{user_id}.{secrets.token_urlsafe(32)}"
+
+    @staticmethod
+    def refresh_key(refresh_token: str) -> str:
+        return f"{AuthRedis.prefix}{refresh_token}"
+
+    @staticmethod
+    def grace_key(refresh_token: str) -> str:
+        return f"{AuthRedis.prefix}grace:{refresh_token}"
+
+    @staticmethod
+    def sessions_key(user_id: int | str) -> str:
+        return f"sessions:{user_id}"
 
-    def get_user_by_refresh_token(self, refresh_token: str) -> list[str | bytes | Any]:
-        if self.database.get(refresh_token):
-            return self.database.get(refresh_token)
+    @staticmethod
+    def user_id_of(refresh_token: str) -> str:
+        user_id, _, _ = refresh_token.partition(".")
+        if not user_id.isdigit():
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        return user_id
+
+    async def get_user_by_refresh_token(self, refresh_token: str) -> bytes:
+        data = await self.database.get(self.refresh_key(refresh_token))
+        if data:
+            return data
         else:
             raise HTTPException(status_code=401, detail="Unauthorized")
 
-    def delete_refresh_token(self, refresh_token: str) -> None:
-        self.database.delete(refresh_token)
+    async def set_refresh_token(self, refresh_token: str, body: str,
+                                expire: timedelta) -> None:
+        user_id = self.user_id_of(refresh_token)
+        seconds = int(expire.total_seconds())
+        async with self.database.pipeline(transaction=False) as pipe:
+            pipe.set(name=self.refresh_key(refresh_token), value=body,
+                     ex=seconds)
+            pipe.sadd(self.sessions_key(user_id), refresh_token)
+            pipe.expire(self.sessions_key(user_id), seconds)
+            await pipe.execute()
+
+    async def rotate_refresh_token(self, refresh_token: str,
+                                   expire: timedelta) -> tuple[str, bytes]:
+        user_id = self.user_id_of(refresh_token)
+        new_token = self.new_refresh_token(int(user_id))
+        rotate = self.database.register_script(ROTATE_SCRIPT)
+        result = await rotate(
+            keys=[self.refresh_key(refresh_token),
+                  self.refresh_key(new_token),
+                  self.sessions_key(user_id),
+                  self.grace_key(refresh_token)],
+            args=[refresh_token, new_token, int(expire.total_seconds()),
+                  REFRESH_GRACE_SECONDS])
+        if not result:
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        token, data = result
+        token = token.decode() if isinstance(token, bytes) else token
+        # A pair from the grace window only stands while its token does,
+        # so a logout or a revocation in between still applies
+        if token != new_token and \
+                not await self.database.exists(self.refresh_key(token)):
+            raise HTTPException(status_code=401, detail="Unauthorized")
+        return token, data
+
+    async def delete_refresh_token(self, *refresh_tokens: str) -> None:
+        async with self.database.pipeline(transaction=False) as pipe:
+            for refresh_token in refresh_tokens:
+                pipe.delete(self.refresh_key(refresh_token),
+                            self.grace_key(refresh_token))
+                pipe.srem(self.sessions_key(self.user_id_of(refresh_token)),
+                          refresh_token)
+            await pipe.execute()
         return None
 
+    async def revoke_user_sessions(self, user_id: int) -> int:
+        """Deletes every refresh token of the user. The keys are named
+        from here rather than in a script, which may only touch the keys
+        it is given"""
+        sessions = self.sessions_key(user_id)
+        tokens = [token.decode() for token in
+                  await self.database.smembers(sessions)]
+        if not tokens:
+            return 0
+        async with self.database.pipeline(transaction=False) as pipe:
+            pipe.delete(*map(self.refresh_key, tokens))
+            pipe.srem(sessions, *tokens)
+            await pipe.execute()
+        return len(tokens)
+
+
+class VerifiedTokenCache:
+    """In-process LRU of access tokens that already passed verification.
+    Entries are dropped once the token's exp has passed"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: OrderedDict[str, tuple[TokenData, float]] = \
+            OrderedDict()
+
+    def get(self, token: str) -> TokenData | None:
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        data, expire = entry
+        if expire <= time.time():
+            del self.entries[token]
+            return None
+        self.entries.move_to_end(token)
+        return data
+
+    def put(self, token: str, data: TokenData, expire: float) -> None:
+        self.entries[token] = (data, expire)
+        self.entries.move_to_end(token)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
 
 class Token:
     """Class created for verify and make JWT strategy for access token
     and refresh token, initialization and refresh access token"""
 
-    secret_key: str = SECRET_KEY
-    algorithm: str = ALGORITHM
     live: int = ACCESS_TOKEN_EXPIRE_MINUTES
+    verified = VerifiedTokenCache(size=TOKEN_CACHE_SIZE)
 
     @staticmethod
     def create_access_token(data: UserGet,
@@ -71,18 +222,21 @@ class Token:
             "is_admin": data.is_admin,
         }
         if expires_delta:
-            expire = datetime.utcnow() + expires_delta
+            expire = datetime.now(timezone.utc) + expires_delta
         else:
-            expire = datetime.utcnow() + timedelta(minutes=30)
+            expire = datetime.now(timezone.utc) + ACCESS_TOKEN_EXPIRE
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, Token.secret_key, Token.algorithm)
+        signing = key_ring.signing_key()
+        headers = {"kid": signing.kid} if signing.kid else None
+        encoded_jwt = jwt.encode(to_encode, signing.key, signing.algorithm,
+                                 headers=headers)
         return encoded_jwt
 
     @staticmethod
-    def create_refresh_token(data: UserGet, head: datetime = datetime.now(),
-                             database: Redis = redis_session) -> dict:
+    async def create_refresh_token(data: UserGet,
+                                   database: Redis = redis_session) -> dict:
         refresh_token = {
-            "head": str(Hasher.get_hash_password(str(head))),
+            "head": AuthRedis.new_refresh_token(data.id),
             "body": UserGet(
                 id=data.id,
                 username=data.username,
@@ -91,80 +245,124 @@ class Token:
                 is_admin=data.is_admin,
             ).json()
         }
-        database.set(name=refresh_token["head"],
-                     value=refresh_token["body"],
-                     ex=int(timedelta(days=7).total_seconds()))
+        await AuthRedis(session=database).set_refresh_token(
+            refresh_token=refresh_token["head"],
+            body=refresh_token["body"],
+            expire=REFRESH_TOKEN_EXPIRE)
         return refresh_token
 
     @staticmethod
     def decode_token(token: str) -> TokenData | None:
-        result = jwt.decode(token=token, key=Token.secret_key,
-                            algorithms=Token.algorithm)
-        return TokenData(
-            id=result.get("user_id"),
-            username=result.get("username"),
-            is_admin=result.get("is_admin"),
-        )
-
-    @staticmethod
-    def create_token_by_refresh_token(refresh_token: str) \
-            -> str | HTTPException:
-        data = redis_session.get(refresh_token)
-        if data:
-            return Token.create_access_token(UserGet(**json.loads(data)))
-        else:
+        data = Token.verified.get(token)
+        if data is None:
+            kid = jwt.get_unverified_header(token).get("kid")
+            if kid is not None and not isinstance(kid, str):
+                raise JWTError("Invalid kid header")
+            verifying = key_ring.verification_key(kid)
+            if verifying is None:
+                raise JWTError("Unknown signing key")
+            result = jwt.decode(token=token, key=verifying.key,
+                                algorithms=verifying.algorithm,
+                                options={"require_exp": True})
+            data = TokenData(
+                id=result.get("user_id"),
+                username=result.get("username"),
+                is_admin=result.get("is_admin"),
+            )
+            Token.verified.put(token, data, expire=result["exp"])
+        return data
+
+    @staticmethod
+    async def create_token_by_refresh_token(refresh_token: str) \
+            -> tuple[str, str, TokenData]:
+        """Rotates the refresh token and mints an access token from it"""
+        try:
+            refresh_token, data = await AuthRedis().rotate_refresh_token(
+                refresh_token, expire=REFRESH_TOKEN_EXPIRE)
+        except HTTPException:
             raise HTTPException(status_code=401, detail={
                 "status": "error",
                 "data": None,
                 "detail": 'Unauthorized'
             })
+        access_token = Token.create_access_token(UserGet(**json.loads(data)))
+        return access_token, refresh_token, Token.decode_token(access_token)
 
     @staticmethod
-    def verify_token(request: Request) \
-            -> list:
-        get_cookies = [request.cookies.get("access_token"),
-                       request.cookies.get("refresh_token")]
-        if get_cookies[0] is None:
-            if get_cookies[1]:
-                access_token = Token.create_token_by_refresh_token(
-                    get_cookies[1])
-                response = {"message": "New token has been created",
-                            "access_token": access_token}
-                return [access_token, response]
-            else:
-                raise HTTPException(status_code=401, detail={
-                    "status": "Access denied",
-                    "data": None,
-                    "detail": 'Unauthorized'
-                })
-        else:
+    async def get_current_user(request: Request) -> TokenData:
+        """FastAPI dependency resolving the caller once per request.
+        An access token minted from the refresh cookie is kept in
+        request.state.token_response for Token.response"""
+        request.state.token_response = None
+        access_token = request.cookies.get("access_token")
+        refresh_token = request.cookies.get("refresh_token")
+        if access_token:
             try:
-                Token.decode_token(get_cookies[0])
-
-                return [get_cookies[0], None]
-            except JWSError:
-                raise HTTPException(status_code=401, detail={
-                    "status": "Access denied",
-                    "data": None,
-                    "detail": "Invalid token",
-                })
+                return Token.decode_token(access_token)
+            except JWTError:
+                if not refresh_token:
+                    raise HTTPException(status_code=401, detail={
+                        "status": "Access denied",
+                        "data": None,
+                        "detail": "Invalid token",
+                    })
+        if refresh_token:
+            access_token, refresh_token, data = \
+                await Token.create_token_by_refresh_token(refresh_token)
+            request.state.token_response = {
+                "message": "New token has been created",
+                "access_token": access_token,
+                "refresh_token": refresh_token,
+            }
+            return data
+        raise HTTPException(status_code=401, detail={
+            "status": "Access denied",
+            "data": None,
+            "detail": 'Unauthorized'
+        })
 
     @staticmethod
-    def response(body_response: dict, body_token: dict) -> JSONResponse:
+    def response(body_response: Any, body_token: dict,
+                 etag: str | None = None,
+                 status_code: int = 200) -> FastJSONResponse:
 
         """The method is used to help create
-         the response handler and automatically set the cookie."""
+         the response handler and automatically set the cookie.
+         Pydantic models are serialized as is, in a single pass.
+         The ETag describes the bare body, so it is left out of the
+         token envelope."""
 
         if body_token:
             body = {"token_response": body_token,
                     "body_response": body_response}
-            response = JSONResponse(content=body, status_code=200)
-            response.set_cookie("access_token",
-                                body_token["access_token"],
-                                max_age=1800)
+            response = FastJSONResponse(content=body,
+                                        status_code=status_code)
+            Token.set_cookies(response, body_token)
             return response
         else:
-            return JSONResponse(content=body_response, status_code=200)
+            response = FastJSONResponse(content=body_response,
+                                        status_code=status_code)
+            if etag:
+                response.headers["ETag"] = etag
+            return response
+
+    @staticmethod
+    def not_modified(etag: str, body_token: dict) -> Response:
+        response = Response(status_code=304, headers={"ETag": etag})
+        if body_token:
+            Token.set_cookies(response, body_token)
+        return response
+
+    @staticmethod
+    def set_cookies(response: Response, body_token: dict) -> None:
+        response.set_cookie("access_token",
+                            body_token["access_token"],
+                            max_age=int(ACCESS_TOKEN_EXPIRE.total_seconds()))
+        if body_token.get("refresh_token"):
+            response.set_cookie(
+                "refresh_token",
+                body_token["refresh_token"],
+                max_age=int(REFRESH_TOKEN_EXPIRE.total_seconds()))
 
 
 class AuthBL:
@@ -176,7 +374,13 @@ class AuthBL:
                                   session: AsyncSession) -> UserGet | None:
         connect = AuthDB(session=session)
         data = await connect.get_user_by_username(username=username)
-        if Hasher.verify_password(password, data.password):
+        if await Hasher.verify_password_async(password, data.password):
+            if data.is_active is False:
+                raise HTTPException(status_code=403, detail={
+                    "status": "error",
+                    "data": None,
+                    "details": "User is deactivated"
+                })
             return UserGet(
                 id=data.id,
                 username=data.username,
@@ -201,7 +405,23 @@ class AuthBL:
         connect = AuthRedis(session=redis_session)
         refresh_token = request.cookies.get("refresh_token")
         if refresh_token:
-            connect.database.delete(refresh_token)
+            try:
+                await connect.delete_refresh_token(refresh_token)
+            except HTTPException:
+                pass
+        response.delete_cookie(key="access_token")
+        response.delete_cookie(key="refresh_token")
+        return response
+
+    @staticmethod
+    async def delete_all_sessions(user_id: int) -> JSONResponse:
+        revoked = await AuthRedis(session=redis_session) \
+            .revoke_user_sessions(user_id)
+        response = JSONResponse(content={
+            "message": "All sessions have been deleted",
+            "data": {"revoked": revoked},
+            "detail": "All cookies delete",
+        })
         response.delete_cookie(key="access_token")
         response.delete_cookie(key="refresh_token")
         return response
@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+
+from jose import jwk
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+
+from src.config import ALGORITHM, SECRET_KEY
+from src.config import JWT_KEYS_DIR, JWT_ACTIVE_KID, JWT_ACCEPT_HMAC
+from src.config import ConfigError
+
+try:
+    from jose.backends.cryptography_backend import CryptographyECKey
+except ImportError:
+    CryptographyECKey = None
+
+logger = getLogger(__name__)
+
+# python-jose has no EdDSA, ES256 keeps the tokens and signatures short
+KEY_ALGORITHM = "ES256"
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    kid: str | None
+    key: Key | str
+    algorithm: str
+
+
+class KeyRing:
+    """The keys access tokens are signed and verified with.
+
+    Every *.pem file of JWT_KEYS_DIR is an ES256 key whose kid is the
+    file stem. Tokens are signed with JWT_ACTIVE_KID, or the last private
+    key by name, and verified with any key of the ring, so a retired key
+    stays in the directory until its tokens have expired. A public PEM
+    only verifies. Without a directory tokens are signed with the HMAC
+    SECRET_KEY as before.
+
+    ES256 is only signed through the OpenSSL backend of python-jose, the
+    pure Python ecdsa one is open to timing side channels"""
+
+    def __init__(self):
+        self.keys: dict[str, Key] = {}
+        self.active: SigningKey | None = None
+        self.accept_hmac = False
+        self.document: dict = {"keys": []}
+
+    def load(self, directory: str | None = JWT_KEYS_DIR,
+             active_kid: str | None = JWT_ACTIVE_KID,
+             accept_hmac: bool = JWT_ACCEPT_HMAC) -> None:
+        keys: dict[str, Key] = {}
+        if directory:
+            if CryptographyECKey is None or \
+                    jwk.get_key(KEY_ALGORITHM) is not CryptographyECKey:
+                raise ConfigError(f"{KEY_ALGORITHM} needs the cryptography "
+                                  f"backend, install python-jose"
+                                  f"[cryptography]")
+            path = Path(directory)
+            if not path.is_dir():
+                raise ConfigError(f"JWT_KEYS_DIR {directory} is not a "
+                                  f"directory")
+            for file in sorted(path.glob("*.pem")):
+                try:
+                    keys[file.stem] = jwk.construct(file.read_text(),
+                                                    KEY_ALGORITHM)
+                except JWKError as err:
+                    raise ConfigError(f"Invalid JWT key {file}: {err}")
+            private = [kid for kid, key in keys.items()
+                       if not key.is_public()]
+            if not private:
+                raise ConfigError(f"No private key in {directory}")
+            active_kid = active_kid or private[-1]
+            if active_kid not in private:
+                raise ConfigError(f"No private key {active_kid} in "
+                                  f"{directory}")
+            self.active = SigningKey(active_kid, keys[active_kid],
+                                     KEY_ALGORITHM)
+            logger.info("Signing tokens with key %s of %s", active_kid,
+                        ", ".join(keys))
+            self.accept_hmac = accept_hmac
+        else:
+            self.active = SigningKey(None, SECRET_KEY, ALGORITHM)
+            self.accept_hmac = True
+        # Verification needs the public halves, derived once here
+        self.keys = {kid: key.public_key() for kid, key in keys.items()}
+        self.document = {"keys": [
+            {**key.to_dict(), "kid": kid, "use": "sig"}
+            for kid, key in self.keys.items()]}
+
+    def signing_key(self) -> SigningKey:
+        if self.active is None:
+            self.load()
+        return self.active
+
+    def verification_key(self, kid: str | None) -> SigningKey | None:
+        """The key a token with this kid header is checked with. Tokens
+        without a kid are HMAC ones, only accepted next to the key ring
+        with JWT_ACCEPT_HMAC, so the switch to it logs nobody out"""
+        if self.active is None:
+            self.load()
+        if kid is None:
+            if self.accept_hmac and SECRET_KEY and ALGORITHM:
+                return SigningKey(None, SECRET_KEY, ALGORITHM)
+            return None
+        key = self.keys.get(kid)
+        if key is None:
+            return None
+        return SigningKey(kid, key, KEY_ALGORITHM)
+
+    def jwks(self) -> dict:
+        """The public keys as a JSON Web Key Set"""
+        if self.active is None:
+            self.load()
+        return self.document
+
+
+key_ring = KeyRing()
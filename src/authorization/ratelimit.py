@@ -0,0 +1,80 @@
+import math
+import secrets
+import time
+from logging import getLogger
+
+from fastapi import HTTPException, Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.config import LOGIN_RATE_WINDOW, LOGIN_RATE_PER_IP
+from src.config import LOGIN_RATE_PER_USERNAME
+from src.redisdata import connect as redis_session, lua
+
+logger = getLogger(__name__)
+
+# Sliding window over sorted sets of attempt timestamps, one per key.
+# The attempt is recorded on every key only when none of them is full,
+# otherwise the milliseconds until the first one frees a slot are returned
+SLIDING_WINDOW_SCRIPT = lua("""
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local retry = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i + 3])
+    if limit > 0 then
+        redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+        local count = redis.call('ZCARD', key)
+        if count >= limit then
+            local oldest = redis.call('ZRANGE', key, count - limit,
+                                      count - limit, 'WITHSCORES')
+            retry = math.max(retry, tonumber(oldest[2]) + window - now)
+        end
+    end
+end
+if retry > 0 then
+    return retry
+end
+for i, key in ipairs(KEYS) do
+    if tonumber(ARGV[i + 3]) > 0 then
+        redis.call('ZADD', key, now, ARGV[3])
+        redis.call('PEXPIRE', key, window)
+    end
+end
+return 0
+""")
+
+
+class LoginRateLimiter:
+    """Caps login attempts per client IP and per username, so a burst
+    is turned away before it reaches the database or bcrypt"""
+
+    prefix = "ratelimit:login:"
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
+        self.script = self.database.register_script(SLIDING_WINDOW_SCRIPT)
+
+    async def check(self, ip: str, username: str) -> None:
+        now = int(time.time() * 1000)
+        try:
+            retry_after = await self.script(
+                keys=[f"{self.prefix}ip:{ip}",
+                      f"{self.prefix}user:{username}"],
+                args=[now, LOGIN_RATE_WINDOW * 1000,
+                      f"{now}:{secrets.token_hex(4)}",
+                      LOGIN_RATE_PER_IP, LOGIN_RATE_PER_USERNAME])
+        except RedisError as err:
+            # Fail open, the hashing pool still bounds the damage
+            logger.error(err)
+            return None
+        if retry_after:
+            raise HTTPException(status_code=429, detail={
+                "status": "Too Many Requests",
+                "data": None,
+                "detail": "Too many login attempts"
+            }, headers={"Retry-After": str(math.ceil(retry_after / 1000))})
+
+    @staticmethod
+    def client_ip(request: Request) -> str:
+        return request.client.host if request.client else "unknown"
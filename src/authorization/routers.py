@@ -1,15 +1,15 @@
-from datetime import timedelta
-
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from logging import getLogger
 
 from src.database import get_db
+from src.responses import FastJSONResponse
 from src.authorization.crud import AuthBL
-from src.authorization.crud import Token
+from src.authorization.crud import Token, ACCESS_TOKEN_EXPIRE
+from src.authorization.crud import REFRESH_TOKEN_EXPIRE
+from src.authorization.ratelimit import LoginRateLimiter
+from src.authorization.schemas import TokenData
 from src.user.schemas import UserGet, UserCreate
 from src.user.crud import UserBL
 
@@ -19,26 +19,28 @@ logger = getLogger(__name__)
 
 
 @app.post('/login')
-async def login(password: str, username: str,
+async def login(request: Request, password: str, username: str,
                 session: AsyncSession = Depends(get_db)):
+    await LoginRateLimiter().check(ip=LoginRateLimiter.client_ip(request),
+                                   username=username)
     result = await AuthBL.verify_user_by_data(password=password,
                                               username=username,
                                               session=session)
     if result:
         access_token = Token.create_access_token(result)
-        refresh_token = Token.create_refresh_token(result)
-        response = JSONResponse(content={
-            "data": jsonable_encoder(result),
+        refresh_token = await Token.create_refresh_token(result)
+        response = FastJSONResponse(content={
+            "data": result,
             "access_token": access_token,
             "refresh_token": refresh_token["head"]
         }, status_code=200)
 
         response.set_cookie(key="access_token",
                             value=access_token,
-                            max_age=1800)
+                            max_age=int(ACCESS_TOKEN_EXPIRE.total_seconds()))
         response.set_cookie(key="refresh_token",
                             value=refresh_token["head"],
-                            max_age=int(timedelta(days=7).total_seconds()),
+                            max_age=int(REFRESH_TOKEN_EXPIRE.total_seconds()),
                             )
         return response
     else:
@@ -54,6 +56,11 @@ async def logout(request: Request):
     return await AuthBL.delete_session(request)
 
 
+@app.post("/logout/all")
+async def logout_everywhere(user: TokenData = Depends(Token.get_current_user)):
+    return await AuthBL.delete_all_sessions(user_id=user.id)
+
+
 @app.post("/register", response_model=UserGet)
 async def create_user(body: UserCreate,
                       session: AsyncSession = Depends(get_db)) -> UserGet:
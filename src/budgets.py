@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+from logging import getLogger
+
+from src.config import QUERY_BUDGETS
+from src.metrics import registry, Counter, RequestStats
+
+logger = getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Budget:
+    """The most SQL statements and Redis round trips one request of a
+    route may take, on its worst path: cold caches and a token refresh"""
+    sql: int
+    redis: int
+
+
+# Keyed by method and route path. A route missing here is reported as
+# a violation, so a new endpoint has to declare its budget
+BUDGETS: dict[tuple[str, str], Budget] = {
+    ("GET", "/"): Budget(sql=0, redis=0),
+    ("GET", "/metrics"): Budget(sql=0, redis=0),
+    ("GET", "/.well-known/jwks.json"): Budget(sql=0, redis=0),
+    ("POST", "/auth/login"): Budget(sql=1, redis=4),
+    ("POST", "/auth/logout"): Budget(sql=0, redis=1),
+    ("POST", "/auth/logout/all"): Budget(sql=0, redis=2),
+    ("POST", "/auth/register"): Budget(sql=1, redis=1),
+    ("POST", "/user/"): Budget(sql=1, redis=1),
+    ("POST", "/user/{user_id}/deactivate"): Budget(sql=2, redis=3),
+    ("GET", "/user/deactivations/{job_id}"): Budget(sql=0, redis=2),
+    ("GET", "/user/{user_id}/posts"): Budget(sql=2, redis=3),
+    ("GET", "/tasks"): Budget(sql=2, redis=3),
+    ("POST", "/tasks"): Budget(sql=1, redis=3),
+    ("POST", "/tasks/bulk"): Budget(sql=1, redis=3),
+    ("PATCH", "/tasks/bulk"): Budget(sql=2, redis=3),
+    ("DELETE", "/tasks/bulk"): Budget(sql=2, redis=4),
+    ("GET", "/tasks/search"): Budget(sql=1, redis=1),
+    ("GET", "/tasks/export"): Budget(sql=1, redis=1),
+    ("GET", "/tasks/events"): Budget(sql=0, redis=2),
+    ("GET", "/tasks/changes"): Budget(sql=2, redis=1),
+    # One more Redis round trip when a full post cache evicts on the fill
+    ("GET", "/tasks/{task_id}"): Budget(sql=1, redis=4),
+    ("PUT", "/tasks/{task_id}"): Budget(sql=1, redis=3),
+    ("DELETE", "/tasks/{task_id}"): Budget(sql=1, redis=4),
+}
+
+BUDGET_EXCEEDED = registry.register(Counter(
+    "http_request_budget_exceeded_total",
+    "Requests over the SQL or Redis budget of their route",
+    labels=("method", "route")))
+
+
+@dataclass
+class Violation:
+    method: str
+    route: str
+    budget: Budget | None
+    stats: RequestStats
+
+    def describe(self) -> str:
+        budget = (f"budget {self.budget.sql} SQL, {self.budget.redis} Redis"
+                  if self.budget else "no budget")
+        lines = [f"{self.method} {self.route}: {self.stats.db_queries} SQL, "
+                 f"{self.stats.redis_commands} Redis, {budget}"]
+        lines += ["    " + " ".join(statement.split())
+                  for statement in self.stats.statements or ()]
+        return "\n".join(lines)
+
+
+class BudgetChecker:
+    """Compares every request with the budget of its route. Only active
+    when enabled, since it keeps the statements of each request; meant
+    for the bench and for staging, see QUERY_BUDGETS"""
+
+    def __init__(self, budgets: dict[tuple[str, str], Budget],
+                 enabled: bool = False):
+        self.budgets = budgets
+        self.enabled = enabled
+        # The worst violation of each route and how many there were
+        self.offenders: dict[tuple[str, str], tuple[Violation, int]] = {}
+
+    def check(self, method: str, route: str, stats: RequestStats) -> None:
+        if route == "unmatched":
+            return
+        key = (method, route)
+        budget = self.budgets.get(key)
+        if budget is not None and stats.db_queries <= budget.sql and \
+                stats.redis_commands <= budget.redis:
+            return
+        BUDGET_EXCEEDED.inc(method=method, route=route)
+        violation = Violation(method, route, budget, stats)
+        worst, count = self.offenders.get(key, (None, 0))
+        if worst is None:
+            logger.warning("Query budget exceeded: %s",
+                           violation.describe())
+        elif (worst.stats.db_queries, worst.stats.redis_commands) >= \
+                (stats.db_queries, stats.redis_commands):
+            violation = worst
+        self.offenders[key] = (violation, count + 1)
+
+    def report(self) -> str:
+        return "\n".join(f"{violation.describe()}\n    ({count} requests)"
+                         for violation, count in self.offenders.values())
+
+    def reset(self) -> None:
+        self.offenders.clear()
+
+
+budget_checker = BudgetChecker(BUDGETS, enabled=QUERY_BUDGETS)
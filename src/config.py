@@ -1,21 +1,179 @@
 import os
+from dataclasses import dataclass
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def _flag(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes")
+
+
 """Postgres DataBase"""
 DB_HOST = os.environ.get("DB_HOST")
 DB_PORT = os.environ.get("DB_PORT")
 DB_NAME = os.environ.get("DB_NAME")
 DB_USER = os.environ.get("DB_USER")
 DB_PASS = os.environ.get("DB_PASS")
+DB_ECHO = _flag("DB_ECHO", False)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = _flag("DB_POOL_PRE_PING", True)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+DB_REPLICA_URLS = [url.strip() for url in
+                   os.environ.get("DB_REPLICA_URLS", "").split(",")
+                   if url.strip()]
+DB_REPLICA_EJECT_SECONDS = float(os.environ.get("DB_REPLICA_EJECT_SECONDS",
+                                                30))
 
 """JWT secret key"""
 SECRET_KEY = os.environ.get("SECRET_KEY_TOKEN")
 ALGORITHM = os.environ.get("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = os.environ.get("EXPIRE")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("EXPIRE", 30))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 4096))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_EXPIRE_DAYS", 7))
+# How long a rotated refresh token still yields the pair it was swapped
+# for, 0 turns the grace window off
+REFRESH_GRACE_SECONDS = int(os.environ.get("REFRESH_GRACE_SECONDS", 10))
+JWT_KEYS_DIR = os.environ.get("JWT_KEYS_DIR")
+JWT_ACTIVE_KID = os.environ.get("JWT_ACTIVE_KID")
+# Accept tokens without a kid, signed with the HMAC secret, next to the
+# key ring. Only while the last HMAC tokens expire after the switch
+JWT_ACCEPT_HMAC = _flag("JWT_ACCEPT_HMAC", False)
+JWKS_MAX_AGE = int(os.environ.get("JWKS_MAX_AGE", 300))
 
 """Redis DataBase"""
-R_HOST = os.environ.get("REDIS_HOST")
-R_PORT = os.environ.get("REDIS_PORT")
\ No newline at end of file
+R_HOST = os.environ.get("REDIS_HOST", "localhost")
+R_PORT = int(os.environ.get("REDIS_PORT", 6379))
+R_DB = int(os.environ.get("REDIS_DB", 0))
+R_PASSWORD = os.environ.get("REDIS_PASSWORD")
+R_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+R_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 5))
+
+"""Password hashing pool"""
+HASH_EXECUTOR = os.environ.get("HASH_EXECUTOR", "thread")
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", 32))
+
+"""Login rate limit, a limit of 0 turns that key off"""
+LOGIN_RATE_WINDOW = int(os.environ.get("LOGIN_RATE_WINDOW", 60))
+LOGIN_RATE_PER_IP = int(os.environ.get("LOGIN_RATE_PER_IP", 30))
+LOGIN_RATE_PER_USERNAME = int(os.environ.get("LOGIN_RATE_PER_USERNAME", 10))
+
+"""Pagination"""
+PAGE_DEFAULT_LIMIT = int(os.environ.get("PAGE_DEFAULT_LIMIT", 50))
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", 200))
+PAGE_SNIPPET_LENGTH = int(os.environ.get("PAGE_SNIPPET_LENGTH", 200))
+# Page ETags each worker remembers, to tell which revalidations are
+# worth a versions check before the page is read
+PAGE_ETAG_MEMORY_SIZE = int(os.environ.get("PAGE_ETAG_MEMORY_SIZE", 4096))
+
+"""Sync feed, changes younger than the settle window wait for the next
+poll so a transaction committing late is never skipped"""
+SYNC_SETTLE_SECONDS = float(os.environ.get("SYNC_SETTLE_SECONDS", 5))
+# Tombstones older than this are pruned, a client that last synced
+# before that is told to resync in full. The pruner runs every interval
+# in every worker, 0 turns it off
+SYNC_TOMBSTONE_TTL = int(os.environ.get("SYNC_TOMBSTONE_TTL", 30 * 86400))
+SYNC_PRUNE_INTERVAL = float(os.environ.get("SYNC_PRUNE_INTERVAL", 3600))
+SYNC_PRUNE_BATCH_SIZE = int(os.environ.get("SYNC_PRUNE_BATCH_SIZE", 1000))
+
+"""Post events"""
+EVENTS_STREAM_MAXLEN = int(os.environ.get("EVENTS_STREAM_MAXLEN", 1000))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS",
+                                                15))
+EVENTS_REPLAY_LIMIT = int(os.environ.get("EVENTS_REPLAY_LIMIT", 500))
+
+"""Diary export"""
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 500))
+
+"""Post cache"""
+POST_CACHE_TTL = int(os.environ.get("POST_CACHE_TTL", 300))
+POST_CACHE_MAX_ENTRIES = int(os.environ.get("POST_CACHE_MAX_ENTRIES", 10000))
+POST_COUNT_TTL = int(os.environ.get("POST_COUNT_TTL", 3600))
+
+"""User lookup cache, misses are kept for a shorter time. The local
+tier is per worker, a TTL of 0 turns it off"""
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 300))
+USER_CACHE_MISS_TTL = int(os.environ.get("USER_CACHE_MISS_TTL", 30))
+USER_CACHE_LOCAL_TTL = float(os.environ.get("USER_CACHE_LOCAL_TTL", 5))
+USER_CACHE_LOCAL_SIZE = int(os.environ.get("USER_CACHE_LOCAL_SIZE", 4096))
+
+"""User deactivation"""
+DEACTIVATION_BATCH_SIZE = int(os.environ.get("DEACTIVATION_BATCH_SIZE", 500))
+DEACTIVATION_JOB_TTL = int(os.environ.get("DEACTIVATION_JOB_TTL", 86400))
+DEACTIVATION_STALE_SECONDS = int(os.environ.get("DEACTIVATION_STALE_SECONDS",
+                                                300))
+
+"""Bulk post endpoints"""
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", 100))
+
+"""Query budgets, checks every request against src.budgets and logs
+the ones over budget with their statements. Costly, for staging"""
+QUERY_BUDGETS = _flag("QUERY_BUDGETS", False)
+
+"""Startup"""
+WARM_DB_CONNECTIONS = int(os.environ.get("WARM_DB_CONNECTIONS",
+                                         min(DB_POOL_SIZE, 4)))
+WARM_REDIS_CONNECTIONS = int(os.environ.get("WARM_REDIS_CONNECTIONS", 4))
+WARM_HASHER = _flag("WARM_HASHER", True)
+
+
+class ConfigError(RuntimeError):
+    pass
+
+
+@dataclass(frozen=True)
+class Settings:
+    """What create_app does around the lifespan of the app"""
+    warm_db_connections: int = WARM_DB_CONNECTIONS
+    warm_redis_connections: int = WARM_REDIS_CONNECTIONS
+    warm_hasher: bool = WARM_HASHER
+
+
+def validate_config() -> None:
+    """Checks the settings read above, reporting every problem at once"""
+    errors = [f"{name} is not set" for name, value in (
+        ("DB_HOST", DB_HOST), ("DB_PORT", DB_PORT), ("DB_NAME", DB_NAME),
+        ("DB_USER", DB_USER)) if not value]
+    if not JWT_KEYS_DIR:
+        errors += [f"{name} is not set, nor JWT_KEYS_DIR" for name, value
+                   in (("SECRET_KEY_TOKEN", SECRET_KEY),
+                       ("ALGORITHM", ALGORITHM)) if not value]
+    elif JWT_ACCEPT_HMAC and not (SECRET_KEY and ALGORITHM):
+        errors.append("JWT_ACCEPT_HMAC needs SECRET_KEY_TOKEN and ALGORITHM")
+    elif SECRET_KEY and not JWT_ACCEPT_HMAC:
+        errors.append("SECRET_KEY_TOKEN is set next to JWT_KEYS_DIR, unset "
+                      "it or set JWT_ACCEPT_HMAC while HMAC tokens expire")
+    if DB_PORT and not DB_PORT.isdigit():
+        errors.append("DB_PORT must be a number")
+    for name, value in (
+            ("EXPIRE", ACCESS_TOKEN_EXPIRE_MINUTES),
+            ("REFRESH_EXPIRE_DAYS", REFRESH_TOKEN_EXPIRE_DAYS),
+            ("DB_POOL_SIZE", DB_POOL_SIZE),
+            ("REDIS_MAX_CONNECTIONS", R_MAX_CONNECTIONS),
+            ("HASH_WORKERS", HASH_WORKERS),
+            ("PAGE_DEFAULT_LIMIT", PAGE_DEFAULT_LIMIT),
+            ("EXPORT_BATCH_SIZE", EXPORT_BATCH_SIZE),
+            ("DEACTIVATION_BATCH_SIZE", DEACTIVATION_BATCH_SIZE),
+            ("BULK_MAX_ITEMS", BULK_MAX_ITEMS),
+            ("USER_CACHE_TTL", USER_CACHE_TTL),
+            ("USER_CACHE_MISS_TTL", USER_CACHE_MISS_TTL),
+            ("SYNC_TOMBSTONE_TTL", SYNC_TOMBSTONE_TTL),
+            ("SYNC_PRUNE_BATCH_SIZE", SYNC_PRUNE_BATCH_SIZE)):
+        if value < 1:
+            errors.append(f"{name} must be positive")
+    if HASH_EXECUTOR not in ("thread", "process"):
+        errors.append("HASH_EXECUTOR must be thread or process")
+    if PAGE_DEFAULT_LIMIT > PAGE_MAX_LIMIT:
+        errors.append("PAGE_DEFAULT_LIMIT is above PAGE_MAX_LIMIT")
+    if WARM_DB_CONNECTIONS > DB_POOL_SIZE + DB_MAX_OVERFLOW:
+        errors.append("WARM_DB_CONNECTIONS is above the pool capacity")
+    if WARM_REDIS_CONNECTIONS > R_MAX_CONNECTIONS:
+        errors.append("WARM_REDIS_CONNECTIONS is above REDIS_MAX_CONNECTIONS")
+    if errors:
+        raise ConfigError("Invalid configuration: " + "; ".join(errors))
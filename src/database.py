@@ -1,14 +1,49 @@
+import asyncio
+import time
+from contextlib import AsyncExitStack
+from logging import getLogger
 from typing import AsyncGenerator
 
+from sqlalchemy.exc import DBAPIError, OperationalError
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncAttrs
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncConnection
 
 from src.config import DB_USER, DB_PORT, DB_PASS, DB_NAME, DB_HOST
+from src.config import DB_ECHO, DB_POOL_SIZE, DB_MAX_OVERFLOW
+from src.config import DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from src.config import DB_STATEMENT_CACHE_SIZE
+from src.config import DB_REPLICA_URLS, DB_REPLICA_EJECT_SECONDS
+from src.metrics import instrument_engine, InstrumentedQueuePool
+
+logger = getLogger(__name__)
 
 SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@" \
                           f"{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=True)
+
+def make_engine(url: str, name: str) -> AsyncEngine:
+    engine = create_async_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        echo=DB_ECHO,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        # asyncpg's own cache and the one of prepared statements the
+        # SQLAlchemy dialect keeps; 0 turns both off, as pgbouncer needs
+        connect_args={
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        },
+    )
+    instrument_engine(engine, name)
+    return engine
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL, "primary")
 async_session_maker = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
@@ -16,9 +51,131 @@ class Base(AsyncAttrs, DeclarativeBase):
     pass
 
 
+class ReplicaRouter:
+    """Spreads read-only sessions over the replicas round-robin.
+
+    A replica that fails a request is ejected for DB_REPLICA_EJECT_SECONDS,
+    then probed once, by a single request, before it gets traffic again.
+    With no healthy replica left the primary serves the reads"""
+
+    def __init__(self, urls: list[str]):
+        self.engines = [make_engine(url, f"replica-{index}")
+                        for index, url in enumerate(urls)]
+        self.ejected_until = [0.0] * len(self.engines)
+        self.probing = [asyncio.Lock() for _ in self.engines]
+        self.position = 0
+
+    def eject(self, index: int) -> None:
+        logger.warning("Read replica %s ejected", index)
+        self.ejected_until[index] = time.monotonic() + DB_REPLICA_EJECT_SECONDS
+
+    async def _probe(self, index: int) -> bool:
+        async with self.probing[index]:
+            ejected_until = self.ejected_until[index]
+            if ejected_until == 0.0:
+                return True
+            if ejected_until > time.monotonic():
+                return False
+            try:
+                async with self.engines[index].connect():
+                    pass
+            except (OSError, DBAPIError) as err:
+                logger.warning("Read replica %s is still down: %s",
+                               index, err)
+                self.eject(index)
+                return False
+            # A request may have ejected it again while the probe ran
+            if self.ejected_until[index] == ejected_until:
+                self.ejected_until[index] = 0.0
+            return self.ejected_until[index] == 0.0
+
+    async def choose(self) -> int | None:
+        for _ in range(len(self.engines)):
+            index = self.position % len(self.engines)
+            self.position += 1
+            ejected_until = self.ejected_until[index]
+            if ejected_until == 0.0:
+                return index
+            # Another request is probing it already
+            if self.probing[index].locked():
+                continue
+            if ejected_until <= time.monotonic() and await self._probe(index):
+                return index
+        return None
+
+    async def connect(self) -> tuple[int | None, AsyncConnection | None]:
+        """A checked out replica connection, None when the primary has
+        to serve. The checkout pings the server, so a replica that died
+        is ejected here, before the request relies on it"""
+        for _ in range(len(self.engines)):
+            index = await self.choose()
+            if index is None:
+                break
+            try:
+                return index, await self.engines[index].connect()
+            except (OSError, DBAPIError) as err:
+                logger.warning("Read replica %s is down: %s", index, err)
+                self.eject(index)
+        return None, None
+
+
+replica_router = ReplicaRouter(DB_REPLICA_URLS)
+
+
+async def warm_engine(target: AsyncEngine, connections: int) -> None:
+    """Opens connections pooled at once, so the first requests do not
+    pay for the TCP, TLS and auth handshakes"""
+    async with AsyncExitStack() as stack:
+        for _ in range(connections):
+            connection = await stack.enter_async_context(target.connect())
+            await connection.exec_driver_sql("SELECT 1")
+
+
+async def init_db(connections: int) -> None:
+    """Warms the primary, which must be up, and every replica; a replica
+    that fails is ejected instead of failing the startup"""
+    await warm_engine(engine, connections)
+    for index, replica in enumerate(replica_router.engines):
+        try:
+            await warm_engine(replica, connections)
+        except (OSError, DBAPIError) as err:
+            logger.warning("Read replica %s is down at startup: %s",
+                           index, err)
+            replica_router.eject(index)
+
+
+async def close_db() -> None:
+    for target in (engine, *replica_router.engines):
+        await target.dispose()
+
+
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     try:
         async with async_session_maker() as session:
             yield session
     finally:
         await session.close()
+
+
+async def get_read_db() -> AsyncGenerator[AsyncSession, None]:
+    """Session for read-only handlers, bound to a replica if there is one.
+    A replica failing at checkout falls back to the primary, a failure
+    later in the request ejects the replica for the next ones"""
+    index, connection = await replica_router.connect()
+    if connection is None:
+        async with async_session_maker() as session:
+            yield session
+        return
+    try:
+        async with async_session_maker(bind=connection) as session:
+            try:
+                yield session
+            except (OSError, OperationalError) as err:
+                replica_router.eject(index)
+                raise err
+            except DBAPIError as err:
+                if err.connection_invalidated:
+                    replica_router.eject(index)
+                raise err
+    finally:
+        await connection.close()
@@ -0,0 +1,16 @@
+import hashlib
+import json
+
+
+def make_etag(*parts) -> str:
+    """Strong entity tag derived from the values that shape a response"""
+    raw = json.dumps(parts, separators=(",", ":")).encode()
+    return '"' + hashlib.blake2b(raw, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison, so W/ prefixes are ignored"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag
+               for candidate in if_none_match.split(","))
@@ -1,17 +1,74 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from src.user.routers import app as user_router
 from src.post.routers import app as post_router
 from src.authorization.routers import app as auth_router
+from src.config import Settings, validate_config, JWKS_MAX_AGE
+from src.authorization.keys import key_ring
+from src.database import init_db, close_db
+from src.redisdata import init_redis, close_redis
+from src.post.events import event_hub
+from src.post.crud import tombstone_pruner
+from src.security import Hasher
+from src.metrics import registry, MetricsMiddleware
+from src.budgets import budget_checker
+
+
+def make_lifespan(settings: Settings):
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        """Opens the pools before the first request and drains them on
+        shutdown, so every worker starts warm and exits cleanly"""
+        key_ring.load()
+        await init_db(settings.warm_db_connections)
+        await init_redis(settings.warm_redis_connections)
+        if settings.warm_hasher:
+            await Hasher.warm_up()
+        await event_hub.start()
+        await tombstone_pruner.start()
+        try:
+            yield
+        finally:
+            await tombstone_pruner.stop()
+            await event_hub.stop()
+            Hasher.shutdown()
+            await close_redis()
+            await close_db()
 
-app = FastAPI()
+    return lifespan
 
 
-@app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
-app.include_router(user_router, prefix='/user', tags=['user'])
-app.include_router(post_router, prefix='/tasks', tags=['task'])
-app.include_router(auth_router, prefix='/auth', tags=['auth'])
\ No newline at end of file
+async def metrics():
+    return PlainTextResponse(registry.render(),
+                             media_type="text/plain; version=0.0.4")
+
+
+async def jwks():
+    return JSONResponse(key_ring.jwks(), headers={
+        "Cache-Control": f"public, max-age={JWKS_MAX_AGE}"})
+
+
+def create_app(settings: Settings | None = None) -> FastAPI:
+    validate_config()
+    settings = settings or Settings()
+    app = FastAPI(lifespan=make_lifespan(settings))
+    app.add_middleware(MetricsMiddleware, checker=budget_checker)
+    app.add_api_route("/", root, methods=["GET"])
+    app.add_api_route("/metrics", metrics, methods=["GET"],
+                      include_in_schema=False)
+    app.add_api_route("/.well-known/jwks.json", jwks, methods=["GET"],
+                      tags=['auth'])
+    app.include_router(user_router, prefix='/user', tags=['user'])
+    app.include_router(post_router, prefix='/tasks', tags=['task'])
+    app.include_router(auth_router, prefix='/auth', tags=['auth'])
+    return app
+
+
+app = create_app()
@@ -0,0 +1,305 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, replace
+from typing import Callable
+
+from redis import asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, **extra) -> str:
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(
+        name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs)
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} counter"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} "
+                         f"{value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labels)
+        series = self.values.get(key)
+        if series is None:
+            # bucket counts, then sum and count
+            series = self.values[key] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} histogram"]
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labels, key, le=bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key, le="+Inf")
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class StatsCollector:
+    """Exposes the numeric fields of a stats dict read at scrape time"""
+
+    def __init__(self, prefix: str, documentation: str, callback):
+        self.prefix = prefix
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, value in self.callback().items():
+            if isinstance(value, (int, float)) and \
+                    not isinstance(value, bool):
+                name = f"{self.prefix}_{key}"
+                lines += [f"# HELP {name} {self.documentation}",
+                          f"# TYPE {name} untyped",
+                          f"{name} {value}"]
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.collectors = []
+
+    def register(self, collector):
+        self.collectors.append(collector)
+        return collector
+
+    def render(self) -> str:
+        lines = []
+        for collector in self.collectors:
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route",
+    labels=("method", "route", "status")))
+REQUEST_DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements executed per request",
+    labels=("route",), buckets=COUNT_BUCKETS))
+REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in SQL per request",
+    labels=("route",)))
+REQUEST_REDIS_COMMANDS = registry.register(Histogram(
+    "http_request_redis_commands", "Redis round trips per request",
+    labels=("route",), buckets=COUNT_BUCKETS))
+DB_QUERY_LATENCY = registry.register(Histogram(
+    "db_query_duration_seconds", "SQL statement latency",
+    labels=("engine",)))
+DB_POOL_WAIT = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time to check a connection out",
+    labels=("engine",)))
+REDIS_LATENCY = registry.register(Histogram(
+    "redis_command_duration_seconds", "Redis command latency",
+    labels=("command",)))
+
+
+@dataclass
+class RequestStats:
+    """What one request spent, filled in by the engine and Redis hooks.
+    The SQL and Redis commands themselves are only kept when statements
+    is a list"""
+    db_queries: int = 0
+    db_seconds: float = 0.0
+    redis_commands: int = 0
+    redis_seconds: float = 0.0
+    statements: list[str] | None = None
+
+
+current_request: ContextVar[RequestStats | None] = \
+    ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    sync_engine = engine.sync_engine
+    sync_engine.pool.metrics_name = name
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters,
+                             context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        DB_QUERY_LATENCY.observe(elapsed, engine=name)
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_queries += 1
+            stats.db_seconds += elapsed
+            if stats.statements is not None:
+                stats.statements.append(f"SQL {statement}")
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that times how long a checkout waits"""
+
+    metrics_name = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start,
+                                 engine=self.metrics_name)
+
+
+def _observe_redis(command: str, elapsed: float,
+                   describe: Callable[[], str]) -> None:
+    REDIS_LATENCY.observe(elapsed, command=command)
+    stats = current_request.get()
+    if stats is not None:
+        stats.redis_commands += 1
+        stats.redis_seconds += elapsed
+        if stats.statements is not None:
+            stats.statements.append(f"REDIS {describe()}")
+
+
+def _describe_command(args: tuple) -> str:
+    # Names and keys are enough to tell the commands apart, values may
+    # be large or secret
+    return " ".join(str(arg) for arg in args[:2])
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        stack = list(self.command_stack)
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            if stack:
+                _observe_redis("PIPELINE", time.perf_counter() - start,
+                               lambda: "PIPELINE " + "; ".join(
+                                   _describe_command(args)
+                                   for args, _ in stack))
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """Redis client recording the latency of every round trip"""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            _observe_redis(str(args[0]).upper(),
+                           time.perf_counter() - start,
+                           lambda: _describe_command(args))
+
+    def pipeline(self, transaction: bool = True,
+                 shard_hint: str | None = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool,
+                                    self.response_callbacks,
+                                    transaction, shard_hint)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, SQL and Redis work per route.
+    The checker, when given, is handed the stats of every request, see
+    src.budgets"""
+
+    def __init__(self, app, checker=None):
+        self.app = app
+        self.checker = checker
+        self.routes: dict | None = None
+
+    def route_of(self, scope) -> str:
+        if self.routes is None:
+            self.routes = {route.endpoint: route.path
+                           for route in scope["app"].routes
+                           if hasattr(route, "endpoint")}
+        return self.routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        # Set once the last body message is sent: background tasks run
+        # after that and are not part of the request
+        finished: tuple[float, RequestStats] | None = None
+
+        async def send_wrapper(message):
+            nonlocal status, finished
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and \
+                    not message.get("more_body", False) and finished is None:
+                finished = (time.perf_counter() - start, replace(
+                    stats, statements=None if stats.statements is None
+                    else list(stats.statements)))
+
+        recording = self.checker is not None and self.checker.enabled
+        stats = RequestStats(statements=[] if recording else None)
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            if finished is not None:
+                elapsed, stats = finished
+            else:
+                elapsed = time.perf_counter() - start
+            route = self.route_of(scope)
+            REQUEST_LATENCY.observe(elapsed, method=scope["method"],
+                                    route=route, status=status)
+            REQUEST_DB_QUERIES.observe(stats.db_queries, route=route)
+            REQUEST_DB_SECONDS.observe(stats.db_seconds, route=route)
+            REQUEST_REDIS_COMMANDS.observe(stats.redis_commands, route=route)
+            if recording:
+                self.checker.check(scope["method"], route, stats)
@@ -0,0 +1,33 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+
+
+def encode_cursor(**position) -> str:
+    """Packs the keyset position of the last row into an opaque string"""
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, **fields: type) -> dict:
+    """Unpacks a cursor made by encode_cursor, checking the field types"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+        if isinstance(position, dict) and all(
+                isinstance(position.get(name), kind)
+                for name, kind in fields.items()):
+            return position
+    except (ValueError, binascii.Error):
+        pass
+    raise invalid_cursor()
+
+
+def invalid_cursor() -> HTTPException:
+    return HTTPException(status_code=400, detail={
+        "status": "Incorrect request",
+        "data": None,
+        "detail": "Invalid cursor"
+    })
@@ -0,0 +1,309 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+from redis.exceptions import NoScriptError, RedisError
+
+from src.config import POST_CACHE_TTL, POST_CACHE_MAX_ENTRIES
+from src.config import POST_COUNT_TTL, PAGE_ETAG_MEMORY_SIZE
+from src.etag import etag_matches
+from src.redisdata import connect as redis_session, lua
+from src.metrics import registry, StatsCollector
+
+logger = getLogger(__name__)
+
+# Bump when the layout of the cached post changes
+CACHE_VERSION = 2
+
+# SET the entry, touch it in the LRU index and pop the oldest entries
+# beyond the size limit, all in one round trip. The popped ids are
+# returned for the caller to delete, a script may only touch the keys
+# it is given
+FILL_SCRIPT = lua("""
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[4])
+local overflow = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[5])
+if overflow > 0 then
+    local evicted = {}
+    local popped = redis.call('ZPOPMIN', KEYS[2], overflow)
+    for i = 1, #popped, 2 do
+        evicted[#evicted + 1] = popped[i]
+    end
+    return evicted
+end
+return {}
+""")
+
+# Bump the author's count generation and adjust the cached count only
+# while it exists, a missing count is loaded from the database on the
+# next read
+ADJUST_SCRIPT = lua("""
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return false
+""")
+
+# Store a loaded count unless a write moved the generation after it was
+# read, the write's delta would be missing from the loaded number
+FILL_COUNT_SCRIPT = lua("""
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[2] then
+    return false
+end
+return redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3], 'NX')
+""")
+
+
+class PostCacheStats:
+    """Per-process counters of the post cache"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.shared_loads = 0
+        self.fills = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class PostCache:
+    """Read-through cache of post bodies keyed by post id.
+
+    Every entry is stored with the post generation it was loaded under.
+    Invalidation bumps the generation, so a load that raced with an edit
+    is never served. Concurrent misses in one process share one load."""
+
+    stats = PostCacheStats()
+    _inflight: dict[int, asyncio.Future] = {}
+    prefix = f"post:v{CACHE_VERSION}:"
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
+        self.fill_script = self.database.register_script(FILL_SCRIPT)
+
+    @staticmethod
+    def entry_key(post_id: int) -> str:
+        return f"{PostCache.prefix}{post_id}"
+
+    @staticmethod
+    def generation_key(post_id: int) -> str:
+        return f"post:gen:{post_id}"
+
+    @staticmethod
+    def index_key() -> str:
+        return f"{PostCache.prefix}lru"
+
+    async def get(self, post_id: int) -> tuple[dict | None, int]:
+        async with self.database.pipeline(transaction=False) as pipe:
+            pipe.get(self.entry_key(post_id))
+            pipe.get(self.generation_key(post_id))
+            pipe.zadd(self.index_key(), {post_id: time.time()}, xx=True)
+            entry, generation, _ = await pipe.execute()
+        generation = int(generation or 0)
+        if entry:
+            entry = json.loads(entry)
+            if entry["generation"] == generation:
+                return entry["post"], generation
+        return None, generation
+
+    async def set(self, post_id: int, post: dict, generation: int) -> None:
+        evicted = await self.fill_script(
+            keys=[self.entry_key(post_id), self.index_key()],
+            args=[json.dumps({"generation": generation, "post": post}),
+                  POST_CACHE_TTL, time.time(), post_id,
+                  POST_CACHE_MAX_ENTRIES])
+        PostCache.stats.fills += 1
+        if evicted:
+            # Only once the index is full, one more round trip per fill
+            await self.database.delete(*(self.entry_key(int(evicted_id))
+                                         for evicted_id in evicted))
+            PostCache.stats.evictions += len(evicted)
+
+    async def invalidate(self, *post_ids: int) -> None:
+        if not post_ids:
+            return None
+        try:
+            async with self.database.pipeline(transaction=False) as pipe:
+                for post_id in post_ids:
+                    pipe.incr(self.generation_key(post_id))
+                    pipe.expire(self.generation_key(post_id),
+                                2 * POST_CACHE_TTL)
+                pipe.delete(*(self.entry_key(post_id)
+                              for post_id in post_ids))
+                pipe.zrem(self.index_key(), *post_ids)
+                await pipe.execute()
+            PostCache.stats.invalidations += len(post_ids)
+        except RedisError as err:
+            PostCache.stats.errors += 1
+            logger.error(err)
+
+    async def get_or_load(self, post_id: int,
+                          loader: Callable[[], Awaitable[dict | None]]) \
+            -> dict | None:
+        try:
+            post, generation = await self.get(post_id)
+        except RedisError as err:
+            PostCache.stats.errors += 1
+            logger.error(err)
+            return await loader()
+        if post is not None:
+            PostCache.stats.hits += 1
+            return post
+        PostCache.stats.misses += 1
+        future = PostCache._inflight.get(post_id)
+        if future is None:
+            future = asyncio.ensure_future(
+                self._fill(post_id, generation, loader))
+            PostCache._inflight[post_id] = future
+            future.add_done_callback(
+                lambda _: PostCache._inflight.pop(post_id, None))
+        else:
+            PostCache.stats.shared_loads += 1
+        return await asyncio.shield(future)
+
+    async def _fill(self, post_id: int, generation: int,
+                    loader: Callable[[], Awaitable[dict | None]]) \
+            -> dict | None:
+        post = await loader()
+        if post is not None:
+            try:
+                await self.set(post_id, post, generation)
+            except RedisError as err:
+                PostCache.stats.errors += 1
+                logger.error(err)
+        return post
+
+
+class AuthorPostCounts:
+    """Cached number of posts per author, adjusted by the write paths.
+
+    Like PostCache, every write bumps a per-author generation, and a
+    count loaded before that write is not stored"""
+
+    prefix = "post:count:"
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
+        self.adjust_script = self.database.register_script(ADJUST_SCRIPT)
+        self.fill_script = self.database.register_script(FILL_COUNT_SCRIPT)
+
+    @staticmethod
+    def count_key(author_id: int) -> str:
+        return f"{AuthorPostCounts.prefix}{author_id}"
+
+    @staticmethod
+    def generation_key(author_id: int) -> str:
+        return f"{AuthorPostCounts.prefix}gen:{author_id}"
+
+    async def get_or_load(self, author_id: int,
+                          loader: Callable[[], Awaitable[int]]) -> int:
+        """The loader has to read the primary, a replica's count could be
+        cached for all of POST_COUNT_TTL"""
+        try:
+            async with self.database.pipeline(transaction=False) as pipe:
+                pipe.get(self.count_key(author_id))
+                pipe.get(self.generation_key(author_id))
+                count, generation = await pipe.execute()
+        except RedisError as err:
+            logger.error(err)
+            return await loader()
+        if count is not None:
+            return int(count)
+        count = await loader()
+        try:
+            await self.fill_script(
+                keys=[self.count_key(author_id),
+                      self.generation_key(author_id)],
+                args=[count, int(generation or 0), POST_COUNT_TTL])
+        except RedisError as err:
+            logger.error(err)
+        return count
+
+    async def adjust(self, changes: dict[int, int]) -> None:
+        """Applies {author_id: delta} to the cached counts, in one round
+        trip however many authors there are"""
+        changes = {author_id: delta for author_id, delta in changes.items()
+                   if delta}
+        if not changes:
+            return None
+        try:
+            try:
+                await self._adjust(changes)
+            except NoScriptError:
+                await self.database.script_load(ADJUST_SCRIPT)
+                await self._adjust(changes)
+        except RedisError as err:
+            logger.error(err)
+
+    async def _adjust(self, changes: dict[int, int]) -> None:
+        # EVALSHA queued as is, as in PostEvents._publish
+        async with self.database.pipeline(transaction=False) as pipe:
+            for author_id, delta in changes.items():
+                pipe.evalsha(self.adjust_script.sha, 2,
+                             self.count_key(author_id),
+                             self.generation_key(author_id),
+                             delta, POST_COUNT_TTL)
+            await pipe.execute()
+
+
+class PageETags:
+    """The ETags this worker served for post pages, so a revalidation
+    only checks the page versions when a 304 is likely: the client has
+    the tag served last and no post of the page's scope changed since.
+    Anything else reads the page at once and derives the tag from it.
+
+    Changes are learnt from the post events of every worker, a page of
+    all posts is stale after any change, a feed after one of its
+    author's"""
+
+    entries: OrderedDict[tuple, tuple[str, int, int]] = OrderedDict()
+    generation = 0
+    author_generations: dict[int, int] = {}
+
+    @staticmethod
+    def _generations(author_id: int | None) -> tuple[int, int]:
+        if author_id is None:
+            return PageETags.generation, 0
+        return 0, PageETags.author_generations.get(author_id, 0)
+
+    @staticmethod
+    def remember(key: tuple, author_id: int | None, etag: str) -> None:
+        entries = PageETags.entries
+        entries[key] = (etag, *PageETags._generations(author_id))
+        entries.move_to_end(key)
+        if len(entries) > PAGE_ETAG_MEMORY_SIZE:
+            entries.popitem(last=False)
+
+    @staticmethod
+    def likely_current(key: tuple, author_id: int | None,
+                       if_none_match: str) -> bool:
+        entry = PageETags.entries.get(key)
+        if entry is None:
+            return False
+        etag, *generations = entry
+        return tuple(generations) == PageETags._generations(author_id) \
+            and etag_matches(if_none_match, etag)
+
+    @staticmethod
+    def changed(author_id: int) -> None:
+        PageETags.generation += 1
+        PageETags.author_generations[author_id] = \
+            PageETags.author_generations.get(author_id, 0) + 1
+
+    @staticmethod
+    def forget_all() -> None:
+        PageETags.entries.clear()
+
+
+registry.register(StatsCollector("post_cache", "Post cache events",
+                                 lambda: PostCache.stats.as_dict()))
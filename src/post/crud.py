@@ -1,10 +1,48 @@
+import asyncio
+import json
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import AsyncIterator
+
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncResult
+from sqlalchemy import select, insert, update, delete, true, Row
+from sqlalchemy import func, cast, tuple_, literal_column, REAL
+from sqlalchemy import values, column, Integer, String
 
-from src.post.models import Post
-from src.post.schemas import PostGet, PostCreate
+from src.database import async_session_maker
+from src.post.models import Post, PostTombstone, SEARCH_CONFIG
+from src.post.cache import PostCache, AuthorPostCounts
+from src.post.events import PostEvents
+from src.post.schemas import PostGet, PostPage, PostView
+from src.post.schemas import PostSummary, PostSummaryPage
+from src.post.schemas import PostChange, PostChangePage
+from src.post.schemas import PostSearchHit, PostSearchPage
+from src.post.schemas import PostUpdate, PostBulkResult, PostBulkResponse
 from src.post.schemas import Post as PostSchema
+from src.pagination import encode_cursor, decode_cursor, invalid_cursor
+from src.etag import make_etag
+from src.config import EXPORT_BATCH_SIZE, PAGE_SNIPPET_LENGTH
+from src.config import SYNC_SETTLE_SECONDS, SYNC_TOMBSTONE_TTL
+from src.config import SYNC_PRUNE_INTERVAL, SYNC_PRUNE_BATCH_SIZE
+
+logger = getLogger(__name__)
+
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, " \
+                   "MaxWords=35, MinWords=15, MaxFragments=2"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _to_micros(moment: datetime) -> int:
+    """Exact integer form of a timestamp, for cursors"""
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> datetime:
+    return EPOCH + timedelta(microseconds=micros)
 
 
 class PostDB:
@@ -18,24 +56,251 @@ class PostDB:
         await self.session.flush()
         return new_post
 
-    async def get_all_post(self):
-        stmt = select(Post)
-        return await self.session.scalars(stmt)
+    async def create_posts(self, rows: list[dict]) -> list[Row]:
+        stmt = insert(Post).returning(Post.id, Post.title, Post.text,
+                                      Post.author_id, Post.version,
+                                      sort_by_parameter_order=True)
+        result = await self.session.execute(stmt, rows)
+        return result.all()
+
+    async def get_post_authors(self, ids: list[int]) -> dict[int, int]:
+        stmt = (select(Post.id, Post.author_id)
+                .where(Post.id.in_(ids))
+                .with_for_update())
+        result = await self.session.execute(stmt)
+        return dict(result.all())
+
+    async def update_posts(self, rows: list[dict]) -> list[Row]:
+        data = values(column("id", Integer), column("title", String),
+                      column("text", String), name="data") \
+            .data([(row["id"], row["title"], row["text"]) for row in rows])
+        stmt = (update(Post)
+                .where(Post.id == data.c.id)
+                .values(title=data.c.title, text=data.c.text,
+                        version=Post.version + 1, updated_at=func.now())
+                .returning(Post.id, Post.title, Post.text, Post.author_id,
+                           Post.version))
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def delete_author_posts(self, author_id: int,
+                                  limit: int) -> list[Row]:
+        """Deletes up to limit posts of the author, so a large diary is
+        removed in short transactions that each lock one small batch"""
+        batch = (select(Post.id)
+                 .where(Post.author_id == author_id)
+                 .order_by(Post.id)
+                 .limit(limit)
+                 .scalar_subquery())
+        deleted = (delete(Post)
+                   .where(Post.id.in_(batch))
+                   .returning(Post.id, Post.author_id, Post.version)
+                   .cte("deleted"))
+        tombstones = PostDB._tombstones(deleted)
+        stmt = select(deleted).join(
+            tombstones, tombstones.c.post_id == deleted.c.id)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def delete_posts(self, ids: list[int]) -> list[Row]:
+        deleted = (delete(Post)
+                   .where(Post.id.in_(ids))
+                   .returning(Post.id, Post.title, Post.text, Post.author_id,
+                              Post.version)
+                   .cte("deleted"))
+        tombstones = PostDB._tombstones(deleted)
+        stmt = select(deleted).join(
+            tombstones, tombstones.c.post_id == deleted.c.id)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    @staticmethod
+    def _tombstones(deleted):
+        """CTE recording the rows of a DELETE ... RETURNING cte as
+        tombstones, in the same statement as the delete. Each deleted row
+        gets exactly one, so callers join it in to have it rendered"""
+        return (insert(PostTombstone)
+                .from_select(["post_id", "author_id"],
+                             select(deleted.c.id, deleted.c.author_id))
+                .returning(PostTombstone.post_id)
+                .cte("tombstones"))
+
+    @staticmethod
+    def owned_by(user_id: int, is_admin: bool):
+        """SQL expression for the author/admin rule used by PostBL"""
+        if is_admin is True:
+            return true()
+        return Post.author_id == user_id
+
+    @staticmethod
+    def can_edit(user_id: int, is_admin: bool):
+        return PostDB.owned_by(user_id, is_admin).label("can_edit")
+
+    @staticmethod
+    def _page(columns: list, limit: int, after_id: int | None,
+              author_id: int | None = None):
+        stmt = select(*columns).order_by(Post.id.desc()).limit(limit)
+        if after_id is not None:
+            stmt = stmt.where(Post.id < after_id)
+        if author_id is not None:
+            stmt = stmt.where(Post.author_id == author_id)
+        return stmt
+
+    async def get_all_post(self, user_id: int, is_admin: bool, limit: int,
+                           after_id: int | None = None,
+                           author_id: int | None = None) -> list[Row]:
+        stmt = PostDB._page([Post.id, Post.title, Post.text, Post.author_id,
+                             Post.version,
+                             PostDB.can_edit(user_id, is_admin)],
+                            limit, after_id, author_id)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_post_summaries(self, user_id: int, is_admin: bool,
+                                 limit: int, after_id: int | None = None,
+                                 author_id: int | None = None) -> list[Row]:
+        """The same page as get_all_post with a preview instead of the
+        body, cut in the database so the full text never leaves it"""
+        stmt = PostDB._page([Post.id, Post.title, Post.author_id,
+                             Post.version,
+                             PostDB.can_edit(user_id, is_admin),
+                             func.left(Post.text, PAGE_SNIPPET_LENGTH)
+                             .label("snippet"),
+                             func.char_length(Post.text).label("length")],
+                            limit, after_id, author_id)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_page_versions(self, user_id: int, is_admin: bool,
+                                limit: int, after_id: int | None = None,
+                                author_id: int | None = None) -> list[Row]:
+        """The same page as get_all_post without the bodies"""
+        stmt = PostDB._page([Post.id, Post.version,
+                             PostDB.can_edit(user_id, is_admin)],
+                            limit, after_id, author_id)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def count_author_posts(self, author_id: int) -> int:
+        stmt = select(func.count()).where(Post.author_id == author_id)
+        return await self.session.scalar(stmt)
+
+    async def search_posts(self, query: str, user_id: int, is_admin: bool,
+                           limit: int,
+                           after: tuple[float, int] | None = None) -> list[Row]:
+        config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+        tsquery = func.websearch_to_tsquery(config, query)
+        rank = func.ts_rank_cd(Post.search_vector, tsquery)
+        page = (select(Post.id, rank.label("rank"))
+                .where(Post.search_vector.op("@@")(tsquery))
+                .order_by(rank.desc(), Post.id.desc())
+                .limit(limit))
+        if after is not None:
+            page = page.where(tuple_(rank, Post.id) <
+                              tuple_(cast(after[0], REAL), after[1]))
+        page = page.subquery()
+        # ts_headline is the expensive part, so it only runs on the page
+        stmt = (select(Post.id, Post.title, Post.author_id,
+                       PostDB.can_edit(user_id, is_admin), page.c.rank,
+                       func.ts_headline(config, Post.text, tsquery,
+                                        HEADLINE_OPTIONS).label("snippet"))
+                .join(page, page.c.id == Post.id)
+                .order_by(page.c.rank.desc(), Post.id.desc()))
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def stream_author_posts(self, author_id: int,
+                                  after_id: int | None = None) -> AsyncResult:
+        stmt = (select(Post.id, Post.title, Post.text, Post.author_id)
+                .where(Post.author_id == author_id)
+                .order_by(Post.id)
+                .execution_options(yield_per=EXPORT_BATCH_SIZE))
+        if after_id is not None:
+            stmt = stmt.where(Post.id > after_id)
+        return await self.session.stream(stmt)
+
+    async def get_changed_posts(self, author_id: int, before,
+                                after: tuple | None,
+                                limit: int) -> list[Row]:
+        stmt = (select(Post.id, Post.title, Post.text, Post.author_id,
+                       Post.version, Post.updated_at)
+                .where(Post.author_id == author_id,
+                       Post.updated_at < before)
+                .order_by(Post.updated_at, Post.id)
+                .limit(limit))
+        if after is not None:
+            stmt = stmt.where(tuple_(Post.updated_at, Post.id) > after)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def get_tombstones(self, author_id: int, before,
+                             after: tuple | None, limit: int) -> list[Row]:
+        stmt = (select(PostTombstone.post_id, PostTombstone.deleted_at)
+                .where(PostTombstone.author_id == author_id,
+                       PostTombstone.deleted_at < before)
+                .order_by(PostTombstone.deleted_at, PostTombstone.post_id)
+                .limit(limit))
+        if after is not None:
+            stmt = stmt.where(tuple_(PostTombstone.deleted_at,
+                                     PostTombstone.post_id) > after)
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def prune_tombstones(self, before: datetime, limit: int) -> int:
+        """Deletes up to limit tombstones older than before; rows locked
+        by another worker's prune are skipped"""
+        batch = (select(PostTombstone.post_id)
+                 .where(PostTombstone.deleted_at < before)
+                 .order_by(PostTombstone.deleted_at)
+                 .limit(limit)
+                 .with_for_update(skip_locked=True)
+                 .scalar_subquery())
+        stmt = delete(PostTombstone).where(PostTombstone.post_id.in_(batch))
+        result = await self.session.execute(stmt)
+        return result.rowcount
 
     async def get_current_post(self, id: int):
         stmt = select(Post).where(Post.id == id)
         return await self.session.scalar(stmt)
 
-    async def edit_post(self, body: PostCreate, post_id: int):
-        stmt = (update(Post).
-                where(Post.id == post_id).
-                values(body.dict(exclude_unset=True)).
-                returning(Post))
-        return await self.session.execute(stmt)
+    async def _modify_owned_post(self, stmt, post_id: int,
+                                 tombstone: bool = False) -> Row | None:
+        """Runs an ownership-checked UPDATE/DELETE ... RETURNING together
+        with a lookup of the target row, in a single statement.
 
-    async def delete_post(self, post_id: int):
-        stmt = delete(Post).where(Post.id == post_id)
-        return await self.session.execute(stmt)
+        No row means the post does not exist; a row with id None means
+        the predicate rejected it, target_author_id tells why"""
+        target = (select(Post.id, Post.author_id)
+                  .where(Post.id == post_id)
+                  .cte("target"))
+        changed = stmt.returning(Post.id, Post.title, Post.text,
+                                 Post.author_id, Post.version).cte("changed")
+        query = (select(target.c.author_id.label("target_author_id"),
+                        changed.c.id, changed.c.title, changed.c.text,
+                        changed.c.author_id, changed.c.version)
+                 .select_from(target.outerjoin(changed, true())))
+        if tombstone:
+            tombstones = PostDB._tombstones(changed)
+            query = query.outerjoin(tombstones,
+                                    tombstones.c.post_id == changed.c.id)
+        result = await self.session.execute(query)
+        return result.first()
+
+    async def edit_post(self, body: PostSchema, post_id: int,
+                        user_id: int, is_admin: bool) -> Row | None:
+        stmt = (update(Post)
+                .where(Post.id == post_id,
+                       PostDB.owned_by(user_id, is_admin))
+                .values(title=body.title, text=body.text,
+                        version=Post.version + 1, updated_at=func.now()))
+        return await self._modify_owned_post(stmt, post_id)
+
+    async def delete_post(self, post_id: int, user_id: int,
+                          is_admin: bool) -> Row | None:
+        stmt = (delete(Post)
+                .where(Post.id == post_id,
+                       PostDB.owned_by(user_id, is_admin)))
+        return await self._modify_owned_post(stmt, post_id, tombstone=True)
 
 
 class PostBL:
@@ -48,75 +313,373 @@ class PostBL:
             post = await connect.create_post(title=body.title,
                                              text=body.text,
                                              author_id=author_id)
-            return PostGet(
+            result = PostGet(
                 id=post.id,
                 title=post.title,
                 text=post.text,
                 author_id=post.author_id,
+                version=post.version,
                 can_edit=True
             )
+        await AuthorPostCounts().adjust({author_id: 1})
+        await PostEvents().publish("upsert", [result])
+        return result
 
     @staticmethod
-    async def get_post(post_id: int, session: AsyncSession,
-                       user_id: int, is_admin: bool) -> PostGet:
+    async def create_posts(items: list[PostSchema], author_id: int,
+                           session: AsyncSession) -> PostBulkResponse:
         async with session.begin():
             connect = PostDB(session=session)
-            result = await connect.get_current_post(id=post_id)
-            if result:
-                if user_id == result.author_id or is_admin is True:
-                    return PostGet(
-                        id=result.id,
-                        title=result.title,
-                        text=result.text,
-                        author_id=result.author_id,
-                        can_edit=True
-                    )
-                else:
-                    return PostGet(
-                        id=result.id,
-                        title=result.title,
-                        text=result.text,
-                        author_id=result.author_id,
-                        can_edit=False
-                    )
+            rows = await connect.create_posts([
+                {"title": item.title, "text": item.text,
+                 "author_id": author_id}
+                for item in items
+            ])
+        await AuthorPostCounts().adjust({author_id: len(rows)})
+        await PostEvents().publish("upsert", rows)
+        return PostBulkResponse(items=[
+            PostBulkResult(index=index, id=row.id, status="created",
+                           data=PostGet(**row._mapping, can_edit=True))
+            for index, row in enumerate(rows)
+        ])
+
+    @staticmethod
+    def _check_bulk_access(ids: list[int], authors: dict[int, int],
+                           user_id: int, is_admin: bool) \
+            -> list[PostBulkResult | None]:
+        """Per-item result for rejected ids, None for the ones to write"""
+        results, seen = [], set()
+        for index, post_id in enumerate(ids):
+            if post_id in seen:
+                status = "duplicate"
+            elif post_id not in authors:
+                status = "not_found"
+            elif authors[post_id] != user_id and is_admin is not True:
+                status = "forbidden"
             else:
-                raise HTTPException(status_code=400, detail={
-                    "status": "Incorrect request",
-                    "data": None,
-                    "detail": 'does not exist'
-                })
+                status = None
+            seen.add(post_id)
+            results.append(status and PostBulkResult(index=index,
+                                                     id=post_id,
+                                                     status=status))
+        return results
+
+    @staticmethod
+    async def edit_posts(items: list[PostUpdate], user_id: int,
+                         is_admin: bool,
+                         session: AsyncSession) -> PostBulkResponse:
+        ids = [item.id for item in items]
+        async with session.begin():
+            connect = PostDB(session=session)
+            authors = await connect.get_post_authors(ids)
+            results = PostBL._check_bulk_access(ids, authors,
+                                                user_id, is_admin)
+            allowed = [item.dict() for item, result in zip(items, results)
+                       if result is None]
+            rows = await connect.update_posts(allowed) if allowed else []
+        updated = {row.id: row for row in rows}
+        await PostCache().invalidate(*updated)
+        await PostEvents().publish("upsert", rows)
+        return PostBulkResponse(items=[
+            result or PostBulkResult(
+                index=index, id=post_id, status="updated",
+                data=PostGet(**updated[post_id]._mapping, can_edit=True))
+            for index, (post_id, result) in enumerate(zip(ids, results))
+        ])
+
+    @staticmethod
+    async def delete_posts(ids: list[int], user_id: int, is_admin: bool,
+                           session: AsyncSession) -> PostBulkResponse:
+        async with session.begin():
+            connect = PostDB(session=session)
+            authors = await connect.get_post_authors(ids)
+            results = PostBL._check_bulk_access(ids, authors,
+                                                user_id, is_admin)
+            allowed = [post_id for post_id, result in zip(ids, results)
+                       if result is None]
+            rows = await connect.delete_posts(allowed) if allowed else []
+        deleted = {row.id: row for row in rows}
+        await PostCache().invalidate(*deleted)
+        await AuthorPostCounts().adjust(
+            {author: -count for author, count in
+             Counter(row.author_id for row in rows).items()})
+        await PostEvents().publish("delete", rows)
+        return PostBulkResponse(items=[
+            result or PostBulkResult(
+                index=index, id=post_id, status="deleted",
+                data=PostGet(**deleted[post_id]._mapping, can_edit=True))
+            for index, (post_id, result) in enumerate(zip(ids, results))
+        ])
+
+    @staticmethod
+    async def get_post(post_id: int, user_id: int,
+                       is_admin: bool) -> PostGet:
+        # The load may be shared by concurrent misses, so it runs on a
+        # session of its own rather than one that belongs to a request
+        async def load_post() -> dict | None:
+            async with async_session_maker() as session, session.begin():
+                connect = PostDB(session=session)
+                result = await connect.get_current_post(id=post_id)
+                if result:
+                    return {
+                        "id": result.id,
+                        "title": result.title,
+                        "text": result.text,
+                        "author_id": result.author_id,
+                        "version": result.version,
+                    }
+
+        data = await PostCache().get_or_load(post_id, load_post)
+        if data:
+            return PostGet(
+                **data,
+                can_edit=user_id == data["author_id"] or is_admin is True
+            )
+        else:
+            raise HTTPException(status_code=400, detail={
+                "status": "Incorrect request",
+                "data": None,
+                "detail": 'does not exist'
+            })
+
+    @staticmethod
+    def post_etag(post: PostGet) -> str:
+        return make_etag("post", post.id, post.version, post.can_edit)
+
+    @staticmethod
+    def page_etag(versions: list, has_more: bool,
+                  view: PostView = "full", total: int | None = None) -> str:
+        return make_etag("page", view, [[row.id, row.version, row.can_edit]
+                                        for row in versions],
+                         has_more, total)
+
+    @staticmethod
+    async def get_page_etag(user_id: int, is_admin: bool,
+                            session: AsyncSession, limit: int,
+                            after: str | None = None,
+                            view: PostView = "full",
+                            author_id: int | None = None) -> str:
+        """ETag of the page get_all_posts would return, without bodies"""
+        after_id = decode_cursor(after, id=int)["id"] if after else None
+        async with session.begin():
+            connect = PostDB(session=session)
+            rows = await connect.get_page_versions(user_id=user_id,
+                                                   is_admin=is_admin,
+                                                   limit=limit + 1,
+                                                   after_id=after_id,
+                                                   author_id=author_id)
+        total = None
+        if author_id is not None:
+            total = await PostBL.count_author_posts(author_id)
+        return PostBL.page_etag(rows[:limit], len(rows) > limit, view, total)
+
+    @staticmethod
+    async def count_author_posts(author_id: int) -> int:
+        # The count is cached for a long time, so it is read on the
+        # primary even when the page came from a replica
+        async def load_count() -> int:
+            async with async_session_maker() as session, session.begin():
+                connect = PostDB(session=session)
+                return await connect.count_author_posts(author_id)
+
+        return await AuthorPostCounts().get_or_load(author_id, load_count)
 
     @staticmethod
     async def get_all_posts(user_id: int, is_admin: bool,
-                            session: AsyncSession) -> list[PostGet]:
+                            session: AsyncSession, limit: int,
+                            after: str | None = None,
+                            view: PostView = "full",
+                            author_id: int | None = None) \
+            -> PostPage | PostSummaryPage:
+        """Newest first; with author_id only that author's posts, along
+        with their total count"""
+        after_id = decode_cursor(after, id=int)["id"] if after else None
+        connect = PostDB(session=session)
+        if view == "summary":
+            query, item, page = connect.get_post_summaries, PostSummary, \
+                PostSummaryPage
+        else:
+            query, item, page = connect.get_all_post, PostGet, PostPage
+        async with session.begin():
+            rows = await query(user_id=user_id, is_admin=is_admin,
+                               limit=limit + 1, after_id=after_id,
+                               author_id=author_id)
+        items = [item(**row._mapping) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(id=items[-1].id)
+        total = None
+        if author_id is not None:
+            total = await PostBL.count_author_posts(author_id)
+        return page(items=items, next_cursor=next_cursor, total=total)
+
+    @staticmethod
+    async def search_posts(query: str, user_id: int, is_admin: bool,
+                           session: AsyncSession, limit: int,
+                           after: str | None = None) -> PostSearchPage:
+        position = None
+        if after:
+            cursor = decode_cursor(after, rank=float, id=int)
+            position = (cursor["rank"], cursor["id"])
+        async with session.begin():
+            connect = PostDB(session=session)
+            rows = await connect.search_posts(query=query, user_id=user_id,
+                                              is_admin=is_admin,
+                                              limit=limit + 1,
+                                              after=position)
+        items = [PostSearchHit(**row._mapping) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(rank=items[-1].rank, id=items[-1].id)
+        return PostSearchPage(items=items, next_cursor=next_cursor)
+
+    @staticmethod
+    async def get_changes(author_id: int, session: AsyncSession, limit: int,
+                          since: str | None = None) -> PostChangePage:
+        """Posts of the author changed or deleted since the cursor, oldest
+        first. The cursor keeps a (timestamp, id) position for the posts
+        and one for the tombstones, the two streams are merged here"""
+        positions = {"p": None, "d": None}
+        now = datetime.now(timezone.utc)
+        if since:
+            cursor = decode_cursor(since, p=list, d=list)
+            try:
+                positions = {key: (_from_micros(int(value[0])),
+                                   int(value[1])) if value else None
+                             for key, value in cursor.items()
+                             if key in positions}
+                if "s" in cursor:
+                    synced_at = _from_micros(int(cursor["s"]))
+                else:
+                    # Cursors from before the sync time was kept only
+                    # tell when the last change the client saw was
+                    synced_at = max((value[0] for value in
+                                     positions.values() if value),
+                                    default=None)
+            except (TypeError, ValueError, IndexError, OverflowError):
+                raise invalid_cursor()
+            if synced_at is not None and \
+                    now - synced_at > timedelta(seconds=SYNC_TOMBSTONE_TTL):
+                # Deletes since then may have been pruned already
+                return PostChangePage(
+                    items=[], next_cursor=PostBL._changes_cursor(
+                        {"p": None, "d": None}, now),
+                    has_more=True, resync=True)
+        before = func.now() - timedelta(seconds=SYNC_SETTLE_SECONDS)
         async with session.begin():
             connect = PostDB(session=session)
-            data = await connect.get_all_post()
-            result = []
-            if data:
-                for post in data:
-                    if user_id == post.author_id or is_admin is True:
-                        result.append(PostGet(
-                            id=post.id,
-                            title=post.title,
-                            text=post.text,
-                            author_id=post.author_id,
-                            can_edit=True
-                        ))
-                    else:
-                        result.append(PostGet(
-                            id=post.id,
-                            title=post.title,
-                            text=post.text,
-                            author_id=post.author_id,
-                            can_edit=False
-                        ))
-                return result
+            posts = await connect.get_changed_posts(
+                author_id=author_id, before=before, after=positions["p"],
+                limit=limit + 1)
+            tombstones = await connect.get_tombstones(
+                author_id=author_id, before=before, after=positions["d"],
+                limit=limit + 1)
+        items = PostBL._merge_changes(posts, tombstones, positions, limit)
+        return PostChangePage(items=items,
+                              next_cursor=PostBL._changes_cursor(positions,
+                                                                 now),
+                              has_more=len(posts) + len(tombstones) > limit)
+
+    @staticmethod
+    def _merge_changes(posts: list[Row], tombstones: list[Row],
+                       positions: dict, limit: int) -> list[PostChange]:
+        """The oldest limit changes of both streams, a post before its
+        tombstone at the same instant; positions move past them"""
+        merged = sorted(
+            [(row.updated_at, 0, row.id, row) for row in posts] +
+            [(row.deleted_at, 1, row.post_id, row) for row in tombstones],
+            key=lambda change: change[:3])[:limit]
+        items = []
+        for changed_at, kind, post_id, row in merged:
+            if kind == 0:
+                positions["p"] = (changed_at, post_id)
+                post = PostGet(id=row.id, title=row.title, text=row.text,
+                               author_id=row.author_id, version=row.version,
+                               can_edit=True)
+                items.append(PostChange(id=post_id, op="upsert",
+                                        changed_at=changed_at, post=post))
             else:
-                raise HTTPException(status_code=503, detail={
-                    "status": "Service Unavailable",
-                    "detail": "Try again later"
-                })
+                positions["d"] = (changed_at, post_id)
+                items.append(PostChange(id=post_id, op="delete",
+                                        changed_at=changed_at))
+        return items
+
+    @staticmethod
+    def _changes_cursor(positions: dict, synced_at: datetime) -> str:
+        return encode_cursor(s=_to_micros(synced_at), **{
+            key: [_to_micros(value[0]), value[1]] if value else []
+            for key, value in positions.items()})
+
+    @staticmethod
+    async def prune_tombstones(session: AsyncSession,
+                               limit: int = SYNC_PRUNE_BATCH_SIZE) -> int:
+        """Prunes the tombstones past SYNC_TOMBSTONE_TTL, one committed
+        batch of limit at a time; returns how many went"""
+        before = datetime.now(timezone.utc) - \
+            timedelta(seconds=SYNC_TOMBSTONE_TTL)
+        pruned = 0
+        while True:
+            async with session.begin():
+                connect = PostDB(session=session)
+                count = await connect.prune_tombstones(before=before,
+                                                       limit=limit)
+            pruned += count
+            if count < limit:
+                return pruned
+
+    @staticmethod
+    async def export_posts(author_id: int, session: AsyncSession,
+                           after_id: int | None = None,
+                           compress: bool = False) -> AsyncIterator[bytes]:
+        """Yields the author's posts as NDJSON, one chunk per fetched batch,
+        so memory stays flat however large the diary is"""
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        async with session.begin():
+            connect = PostDB(session=session)
+            result = await connect.stream_author_posts(author_id=author_id,
+                                                       after_id=after_id)
+            async for rows in result.partitions():
+                chunk = "".join(json.dumps(dict(row._mapping)) + "\n"
+                                for row in rows).encode()
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+        if compressor:
+            yield compressor.flush()
+
+    @staticmethod
+    async def delete_author_posts(author_id: int, session: AsyncSession,
+                                  limit: int) -> int:
+        """One committed batch of the author's posts, returns its size"""
+        async with session.begin():
+            connect = PostDB(session=session)
+            rows = await connect.delete_author_posts(author_id=author_id,
+                                                     limit=limit)
+        await PostCache().invalidate(*(row.id for row in rows))
+        await AuthorPostCounts().adjust({author_id: -len(rows)})
+        await PostEvents().publish("delete", rows)
+        return len(rows)
+
+    @staticmethod
+    def _check_modified(row: Row | None, user_id: int,
+                        is_admin: bool) -> None:
+        if row is not None and row.id is not None:
+            return None
+        # The target was seen but the write matched nothing: either the
+        # caller may not touch it, or it was deleted concurrently
+        if row is not None and row.target_author_id != user_id \
+                and is_admin is not True:
+            raise HTTPException(status_code=403, detail={
+                "status": "Access denied",
+                "data": None,
+                "detail": "Forbidden"
+            })
+        raise HTTPException(status_code=400, detail={
+            "status": "Incorrect request",
+            "data": None,
+            "detail": 'does not exist'
+        })
 
     @staticmethod
     async def edit_post(post_id: int, user_id: int, is_admin: bool,
@@ -124,64 +687,75 @@ class PostBL:
                         session: AsyncSession) -> PostGet:
         async with session.begin():
             connect = PostDB(session=session)
-            data = await connect.get_current_post(id=post_id)
-            if data:
-                if data.author_id == user_id or is_admin is True:
-                    new_data = PostCreate(
-                        title=body.title,
-                        text=body.text,
-                        author_id=data.author_id,
-                    )
-                    await connect.edit_post(body=new_data,
-                                            post_id=post_id)
-                    result = await connect.get_current_post(id=post_id)
-                    return PostGet(
-                        id=result.id,
-                        title=result.title,
-                        text=result.text,
-                        author_id=result.author_id,
-                        can_edit=True
-                    )
-                else:
-                    raise HTTPException(status_code=403, detail={
-                        "status": "Access denied",
-                        "data": None,
-                        "detail": "Forbidden"
-                    })
-            else:
-                raise HTTPException(status_code=400, detail={
-                    "status": "Incorrect request",
-                    "data": None,
-                    "detail": 'does not exist'
-                })
+            row = await connect.edit_post(body=body, post_id=post_id,
+                                          user_id=user_id, is_admin=is_admin)
+        PostBL._check_modified(row, user_id, is_admin)
+        await PostCache().invalidate(post_id)
+        await PostEvents().publish("upsert", [row])
+        return PostGet(
+            id=row.id,
+            title=row.title,
+            text=row.text,
+            author_id=row.author_id,
+            version=row.version,
+            can_edit=True
+        )
 
     @staticmethod
     async def delete_post(post_id: int, user_id: int,
                           is_admin: bool, session: AsyncSession) -> dict:
         async with session.begin():
             connect = PostDB(session=session)
-            post_data = await connect.get_current_post(id=post_id)
-            if post_data:
-                if post_data.author_id == user_id or is_admin is True:
-                    result = await connect.delete_post(post_id=post_id)
-                    return {"status": "Access done",
-                            "data": PostGet(
-                                id=post_data.id,
-                                title=post_data.title,
-                                text=post_data.text,
-                                author_id=post_data.author_id,
-                                can_edit=True,
-                            ),
-                            "detail": result}
-                else:
-                    raise HTTPException(status_code=403, detail={
-                        "status": "Access denied",
-                        "data": None,
-                        "detail": "Forbidden"
-                    })
-            else:
-                raise HTTPException(status_code=400, detail={
-                    "status": "Incorrect request",
-                    "data": None,
-                    "detail": 'does not exist'
-                })
+            row = await connect.delete_post(post_id=post_id,
+                                            user_id=user_id,
+                                            is_admin=is_admin)
+        PostBL._check_modified(row, user_id, is_admin)
+        await PostCache().invalidate(post_id)
+        await AuthorPostCounts().adjust({row.author_id: -1})
+        await PostEvents().publish("delete", [row])
+        return {"status": "Access done",
+                "data": PostGet(
+                    id=row.id,
+                    title=row.title,
+                    text=row.text,
+                    author_id=row.author_id,
+                    version=row.version,
+                    can_edit=True,
+                ),
+                "detail": {"rowcount": 1}}
+
+
+class TombstonePruner:
+    """Prunes old tombstones every SYNC_PRUNE_INTERVAL, for the life of
+    the app"""
+
+    def __init__(self, interval: float = SYNC_PRUNE_INTERVAL):
+        self.interval = interval
+        self.task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self.task is None and self.interval > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with async_session_maker() as session:
+                    pruned = await PostBL.prune_tombstones(session)
+                if pruned:
+                    logger.info("Pruned %s post tombstones", pruned)
+            except Exception:
+                logger.exception("Pruning post tombstones failed")
+
+
+tombstone_pruner = TombstonePruner()
@@ -0,0 +1,241 @@
+import asyncio
+import json
+from logging import getLogger
+from typing import AsyncIterator, Iterable
+
+from redis.asyncio import Redis
+from redis.exceptions import NoScriptError, RedisError
+
+from src.config import EVENTS_STREAM_MAXLEN, EVENTS_QUEUE_SIZE
+from src.config import EVENTS_HEARTBEAT_SECONDS, EVENTS_REPLAY_LIMIT
+from src.redisdata import connect as redis_session, lua
+from src.post.cache import PageETags
+
+logger = getLogger(__name__)
+
+CHANNEL = "post:events"
+
+# Append the event to the author's stream, kept for replays, and announce
+# it to every worker, in one round trip. The message is
+# "<author id> <stream id> <json>"
+PUBLISH_SCRIPT = lua("""
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*',
+                      'data', ARGV[2])
+redis.call('PUBLISH', ARGV[3], ARGV[4] .. ' ' .. id .. ' ' .. ARGV[2])
+return id
+""")
+
+
+def _stream_position(event_id: str) -> tuple[int, int]:
+    milliseconds, _, sequence = event_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def _format_event(event_id: str, data: str) -> bytes:
+    return f"id: {event_id}\nevent: post\ndata: {data}\n\n".encode()
+
+
+class PostEvents:
+    """Compact change events of posts, one Redis stream per author"""
+
+    prefix = "post:events:"
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
+        self.publish_script = self.database.register_script(PUBLISH_SCRIPT)
+
+    @staticmethod
+    def stream_key(author_id: int) -> str:
+        return f"{PostEvents.prefix}{author_id}"
+
+    async def publish(self, op: str, posts: Iterable) -> None:
+        """Publishes one event per post (anything with id, author_id and
+        version) in a single round trip; failures are only logged,
+        clients catch up through GET /tasks/changes"""
+        events = [(self.stream_key(post.author_id),
+                   json.dumps({"op": op, "id": post.id,
+                               "version": post.version},
+                              separators=(",", ":")),
+                   post.author_id)
+                  for post in posts]
+        if not events:
+            return None
+        # This worker's page ETags learn of the change before the events
+        # come back from the channel
+        for _, _, author_id in events:
+            PageETags.changed(author_id)
+        try:
+            try:
+                await self._publish(events)
+            except NoScriptError:
+                # Redis lost the scripts init_redis loaded, no event of
+                # the pipeline ran
+                await self.database.script_load(PUBLISH_SCRIPT)
+                await self._publish(events)
+        except RedisError as err:
+            logger.error(err)
+
+    async def _publish(self, events: list[tuple[str, str, int]]) -> None:
+        # EVALSHA queued as is: a Script called with client=pipe would
+        # first check the script exists in a round trip of its own
+        async with self.database.pipeline(transaction=False) as pipe:
+            for key, data, author_id in events:
+                pipe.evalsha(self.publish_script.sha, 1, key,
+                             EVENTS_STREAM_MAXLEN, data, CHANNEL, author_id)
+            await pipe.execute()
+
+    async def replay(self, author_id: int, last_event_id: str) \
+            -> list[tuple[str, str]] | None:
+        """Events after last_event_id, None when some of them are no
+        longer in the stream and the client has to resync"""
+        key = self.stream_key(author_id)
+        async with self.database.pipeline(transaction=False) as pipe:
+            pipe.xrange(key, min="-", max="+", count=1)
+            pipe.xrange(key, min=f"({last_event_id}", max="+",
+                        count=EVENTS_REPLAY_LIMIT + 1)
+            first, entries = await pipe.execute()
+        # The stream starts after the client's position: what lay in
+        # between may have been trimmed
+        if first and _stream_position(first[0][0].decode()) > \
+                _stream_position(last_event_id):
+            return None
+        if len(entries) > EVENTS_REPLAY_LIMIT:
+            return None
+        return [(entry_id.decode(), fields[b"data"].decode())
+                for entry_id, fields in entries]
+
+
+class Subscription:
+    def __init__(self, author_id: int):
+        self.author_id = author_id
+        self.queue: asyncio.Queue[tuple[str, str]] = \
+            asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        # Set when an event had to be dropped, the connection is then
+        # closed and the client replays from its last event id
+        self.lost = asyncio.Event()
+
+
+class EventHub:
+    """Per-worker fan-out of the pub/sub channel to connected clients.
+
+    A single subscription per worker feeds a bounded queue per client,
+    so a slow client can only ever hold EVENTS_QUEUE_SIZE events"""
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
+        self.subscriptions: dict[int, set[Subscription]] = {}
+        self.task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.lost.set()
+
+    def subscribe(self, author_id: int) -> Subscription:
+        subscription = Subscription(author_id)
+        self.subscriptions.setdefault(author_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self.subscriptions.get(subscription.author_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscriptions[subscription.author_id]
+
+    def dispatch(self, message: bytes) -> None:
+        try:
+            author_id, event_id, data = message.decode().split(" ", 2)
+            author_id = int(author_id)
+        except (UnicodeDecodeError, ValueError):
+            logger.error("Malformed post event %r", message[:200])
+            return
+        PageETags.changed(author_id)
+        for subscription in self.subscriptions.get(author_id, ()):
+            try:
+                subscription.queue.put_nowait((event_id, data))
+            except asyncio.QueueFull:
+                subscription.lost.set()
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self.database.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.dispatch(message["data"])
+            except Exception:
+                # Anything but a cancellation restarts the listener
+                logger.exception("Post events listener failed")
+                # Events may have been missed, make every client replay
+                PageETags.forget_all()
+                for subscriptions in self.subscriptions.values():
+                    for subscription in subscriptions:
+                        subscription.lost.set()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    async def stream(self, author_id: int,
+                     last_event_id: str | None = None) -> AsyncIterator[bytes]:
+        """Server-sent events for the author: the replay after
+        last_event_id, then live events with a heartbeat comment"""
+        subscription = self.subscribe(author_id)
+        try:
+            position = (0, 0)
+            if last_event_id:
+                try:
+                    position = _stream_position(last_event_id)
+                    events = await PostEvents().replay(author_id,
+                                                       last_event_id)
+                except (ValueError, RedisError):
+                    events = None
+                if events is None:
+                    yield b"event: reset\ndata: {}\n\n"
+                    events = []
+                for event_id, data in events:
+                    position = _stream_position(event_id)
+                    yield _format_event(event_id, data)
+            # Waits on the queue and on lost together, so a lost
+            # subscription closes the stream at once
+            lost = asyncio.ensure_future(subscription.lost.wait())
+            get = None
+            try:
+                while True:
+                    if get is None:
+                        get = asyncio.ensure_future(subscription.queue.get())
+                    done, _ = await asyncio.wait(
+                        (get, lost), timeout=EVENTS_HEARTBEAT_SECONDS,
+                        return_when=asyncio.FIRST_COMPLETED)
+                    if lost in done:
+                        break
+                    if get not in done:
+                        yield b": ping\n\n"
+                        continue
+                    event_id, data = get.result()
+                    get = None
+                    # Events already sent by the replay come again live
+                    if _stream_position(event_id) > position:
+                        position = _stream_position(event_id)
+                        yield _format_event(event_id, data)
+            finally:
+                lost.cancel()
+                if get is not None:
+                    get.cancel()
+        finally:
+            self.unsubscribe(subscription)
+
+
+event_hub = EventHub()
@@ -1,8 +1,14 @@
-from sqlalchemy import Integer, String, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import Integer, String, ForeignKey, Computed, Index, desc
+from sqlalchemy import DateTime, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.database import Base
 
+SEARCH_CONFIG = "simple"
+
 
 class Post(Base):
     __tablename__ = 'posts'
@@ -11,5 +17,44 @@ class Post(Base):
     text: Mapped[str] = mapped_column(String(4000), nullable=False)
     author_id: Mapped[int] = mapped_column(ForeignKey("users.id"),
                                            nullable=False)
+    # Bumped by every edit, backs the ETags of post responses
+    version: Mapped[int] = mapped_column(Integer, nullable=False,
+                                         default=1, server_default="1")
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed(f"setweight(to_tsvector('{SEARCH_CONFIG}', title), 'A') || "
+                 f"setweight(to_tsvector('{SEARCH_CONFIG}', text), 'B')",
+                 persisted=True),
+        deferred=True,
+    )
 
     user: Mapped["User"] = relationship(back_populates="posts")
+
+    __table_args__ = (
+        Index("ix_posts_search_vector", "search_vector",
+              postgresql_using="gin"),
+        # Per-author feeds walk this in keyset order
+        Index("ix_posts_author_id_id", "author_id", desc("id")),
+        # The sync feed walks (updated_at, id) per author
+        Index("ix_posts_author_id_updated_at", "author_id", "updated_at",
+              "id"),
+    )
+
+
+class PostTombstone(Base):
+    """A deleted post, kept so sync clients learn about the delete"""
+    __tablename__ = 'post_tombstones'
+    post_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    author_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    deleted_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_post_tombstones_author_id_deleted_at", "author_id",
+              "deleted_at", "post_id"),
+        Index("ix_post_tombstones_deleted_at", "deleted_at"),
+    )
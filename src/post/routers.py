@@ -1,13 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi import Header
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from logging import getLogger
-from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 from src.post.schemas import PostGet, PostCreate, Post
-from src.database import get_db
+from src.post.schemas import PostBulkCreate, PostBulkUpdate, PostBulkDelete
+from src.post.schemas import PostView
+from src.config import PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT
+from src.database import get_db, get_read_db
+from src.etag import etag_matches
 from src.post.crud import PostBL
+from src.post.cache import PageETags
+from src.post.events import event_hub
 from src.authorization.crud import Token
+from src.authorization.schemas import TokenData
 
 logger = getLogger(__name__)
 
@@ -17,65 +27,208 @@ app = APIRouter()
 @app.post("", response_model=PostGet)
 async def create_post(request: Request,
                       body: Post,
+                      user: TokenData = Depends(Token.get_current_user),
                       session: AsyncSession = Depends(get_db)):
-    user = Token.verify_token(request=request)
-    user_data = Token.decode_token(user[0])
     result = await PostBL.create_post(body=body,
-                                      author_id=user_data.id,
+                                      author_id=user.id,
                                       session=session)
-    return Token.response(body_response=jsonable_encoder(result),
-                          body_token=user[1])
+    return Token.response(body_response=result,
+                          body_token=request.state.token_response)
+
+
+@app.post("/bulk")
+async def create_posts(request: Request, body: PostBulkCreate,
+                       user: TokenData = Depends(Token.get_current_user),
+                       session: AsyncSession = Depends(get_db)):
+    result = await PostBL.create_posts(items=body.items,
+                                       author_id=user.id,
+                                       session=session)
+    return Token.response(body_response=result,
+                          body_token=request.state.token_response)
+
+
+@app.patch("/bulk")
+async def edit_posts(request: Request, body: PostBulkUpdate,
+                     user: TokenData = Depends(Token.get_current_user),
+                     session: AsyncSession = Depends(get_db)):
+    result = await PostBL.edit_posts(items=body.items,
+                                     user_id=user.id,
+                                     is_admin=user.is_admin,
+                                     session=session)
+    return Token.response(body_response=result,
+                          body_token=request.state.token_response)
+
+
+@app.delete("/bulk")
+async def delete_posts(request: Request, body: PostBulkDelete,
+                       user: TokenData = Depends(Token.get_current_user),
+                       session: AsyncSession = Depends(get_db)):
+    result = await PostBL.delete_posts(ids=body.ids,
+                                       user_id=user.id,
+                                       is_admin=user.is_admin,
+                                       session=session)
+    return Token.response(body_response=result,
+                          body_token=request.state.token_response)
+
+
+async def post_page_response(request: Request, user: TokenData,
+                             session: AsyncSession, limit: int,
+                             after: str | None, view: PostView,
+                             if_none_match: str | None,
+                             author_id: int | None = None):
+    """GET /tasks and the per-author feeds. A revalidation that is likely
+    current is answered with 304 from the page versions alone, any other
+    request reads the page once and takes the ETag from its rows"""
+    key = (user.id, user.is_admin, limit, after, view, author_id)
+    if if_none_match and PageETags.likely_current(key, author_id,
+                                                  if_none_match):
+        etag = await PostBL.get_page_etag(session=session,
+                                          user_id=user.id,
+                                          is_admin=user.is_admin,
+                                          limit=limit,
+                                          after=after,
+                                          view=view,
+                                          author_id=author_id)
+        if etag_matches(if_none_match, etag):
+            return Token.not_modified(etag, request.state.token_response)
+    data = await PostBL.get_all_posts(session=session,
+                                      user_id=user.id,
+                                      is_admin=user.is_admin,
+                                      limit=limit,
+                                      after=after,
+                                      view=view,
+                                      author_id=author_id)
+    etag = PostBL.page_etag(data.items, data.next_cursor is not None, view,
+                            data.total)
+    PageETags.remember(key, author_id, etag)
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Token.not_modified(etag, request.state.token_response)
+    return Token.response(body_response=data,
+                          body_token=request.state.token_response,
+                          etag=etag)
 
 
 @app.get("")
 async def get_all_posts(request: Request,
-                        session: AsyncSession = Depends(get_db)):
-    user = Token.verify_token(request=request)
-    user_data = Token.decode_token(user[0])
-    data = await PostBL.get_all_posts(session=session,
-                                      user_id=user_data.id,
-                                      is_admin=user_data.is_admin)
-    return Token.response(body_response=jsonable_encoder(data),
-                          body_token=user[1])
+                        limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1,
+                                           le=PAGE_MAX_LIMIT),
+                        after: str | None = None,
+                        view: PostView = "full",
+                        author: Literal["me"] | None = None,
+                        if_none_match: str | None = Header(None),
+                        user: TokenData = Depends(Token.get_current_user),
+                        session: AsyncSession = Depends(get_read_db)):
+    return await post_page_response(
+        request=request, user=user, session=session, limit=limit,
+        after=after, view=view, if_none_match=if_none_match,
+        author_id=user.id if author == "me" else None)
+
+
+@app.get("/search")
+async def search_posts(request: Request,
+                       q: str = Query(..., min_length=1, max_length=256),
+                       limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1,
+                                          le=PAGE_MAX_LIMIT),
+                       after: str | None = None,
+                       user: TokenData = Depends(Token.get_current_user),
+                       session: AsyncSession = Depends(get_read_db)):
+    data = await PostBL.search_posts(query=q, session=session,
+                                     user_id=user.id,
+                                     is_admin=user.is_admin,
+                                     limit=limit,
+                                     after=after)
+    return Token.response(body_response=data,
+                          body_token=request.state.token_response)
+
+
+@app.get("/export")
+async def export_posts(request: Request, after_id: int | None = None,
+                       compress: bool = False,
+                       user: TokenData = Depends(Token.get_current_user),
+                       session: AsyncSession = Depends(get_read_db)):
+    # A compressed export is a .gz file of its own, not a Content-Encoding
+    # that clients would undo before saving it
+    if compress:
+        filename, media_type = "diary.ndjson.gz", "application/gzip"
+    else:
+        filename, media_type = "diary.ndjson", "application/x-ndjson"
+    response = StreamingResponse(
+        PostBL.export_posts(author_id=user.id, session=session,
+                            after_id=after_id, compress=compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+    if request.state.token_response:
+        Token.set_cookies(response, request.state.token_response)
+    return response
+
+
+@app.get("/events")
+async def post_events(request: Request,
+                      last_event_id: str | None = Header(None),
+                      user: TokenData = Depends(Token.get_current_user)):
+    response = StreamingResponse(
+        event_hub.stream(author_id=user.id, last_event_id=last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    if request.state.token_response:
+        Token.set_cookies(response, request.state.token_response)
+    return response
+
+
+@app.get("/changes")
+async def get_changes(request: Request, since: str | None = None,
+                      limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1,
+                                         le=PAGE_MAX_LIMIT),
+                      user: TokenData = Depends(Token.get_current_user),
+                      session: AsyncSession = Depends(get_db)):
+    data = await PostBL.get_changes(author_id=user.id, session=session,
+                                    limit=limit, since=since)
+    return Token.response(body_response=data,
+                          body_token=request.state.token_response)
 
 
 @app.get("/{task_id}")
 async def get_current_post(task_id: int, request: Request,
-                           session: AsyncSession = Depends(get_db)):
-    user = Token.verify_token(request=request)
-    user_data = Token.decode_token(user[0])
-    data = await PostBL.get_post(post_id=task_id, session=session,
-                                 user_id=user_data.id,
-                                 is_admin=user_data.is_admin)
-    return Token.response(body_response=jsonable_encoder(data),
-                          body_token=user[1])
+                           if_none_match: str | None = Header(None),
+                           user: TokenData = Depends(Token.get_current_user)):
+    # The post comes from the cache, so a revalidation costs what a plain
+    # read does and a changed post is loaded only once
+    data = await PostBL.get_post(post_id=task_id,
+                                 user_id=user.id,
+                                 is_admin=user.is_admin)
+    etag = PostBL.post_etag(data)
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Token.not_modified(etag, request.state.token_response)
+    return Token.response(body_response=data,
+                          body_token=request.state.token_response,
+                          etag=etag)
 
 
 @app.put("/{task_id}", response_model=PostCreate)
 async def edit_post(request: Request, task_id: int,
                     body: Post,
+                    user: TokenData = Depends(Token.get_current_user),
                     session: AsyncSession = Depends(get_db)):
-    user = Token.verify_token(request=request)
-    user_data = Token.decode_token(user[0])
     result = await PostBL.edit_post(post_id=task_id,
-                                    user_id=user_data.id,
-                                    is_admin=user_data.is_admin,
+                                    user_id=user.id,
+                                    is_admin=user.is_admin,
                                     body=body,
                                     session=session)
-    return Token.response(body_response=jsonable_encoder(result),
-                          body_token=user[1])
+    return Token.response(body_response=result,
+                          body_token=request.state.token_response)
 
 
 @app.delete("/{task_id}")
 async def delete_post(request: Request, task_id: int,
+                      user: TokenData = Depends(Token.get_current_user),
                       session: AsyncSession = Depends(get_db)):
-    user = Token.verify_token(request=request)
-    user_data = Token.decode_token(user[0])
     result = await PostBL.delete_post(post_id=task_id,
-                                      user_id=user_data.id,
-                                      is_admin=user_data.is_admin,
+                                      user_id=user.id,
+                                      is_admin=user.is_admin,
                                       session=session)
-    return Token.response(body_response=jsonable_encoder(result),
-                          body_token=user[1])
+    return Token.response(body_response=result,
+                          body_token=request.state.token_response)
 
 
@@ -1,4 +1,9 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Literal
+
+from pydantic import BaseModel, conlist
+
+from src.config import BULK_MAX_ITEMS
 
 
 class Post(BaseModel):
@@ -13,7 +18,90 @@ class PostCreate(Post):
 class PostGet(Post):
     id: int
     author_id: int
+    version: int
     can_edit: bool
 
     class Config:
         orm_mode = True
+
+
+PostView = Literal["full", "summary"]
+
+
+class PostPage(BaseModel):
+    items: list[PostGet]
+    next_cursor: str | None = None
+    total: int | None = None
+
+
+class PostSummary(BaseModel):
+    id: int
+    title: str
+    author_id: int
+    version: int
+    can_edit: bool
+    snippet: str
+    length: int
+
+
+class PostSummaryPage(BaseModel):
+    items: list[PostSummary]
+    next_cursor: str | None = None
+    total: int | None = None
+
+
+class PostSearchHit(BaseModel):
+    id: int
+    title: str
+    author_id: int
+    can_edit: bool
+    rank: float
+    snippet: str
+
+
+class PostSearchPage(BaseModel):
+    items: list[PostSearchHit]
+    next_cursor: str | None = None
+
+
+class PostChange(BaseModel):
+    id: int
+    op: Literal["upsert", "delete"]
+    changed_at: datetime
+    post: PostGet | None = None
+
+
+class PostChangePage(BaseModel):
+    items: list[PostChange]
+    next_cursor: str
+    has_more: bool
+    # The cursor is older than the tombstones kept: drop the local copy
+    # and sync again from next_cursor, which starts from scratch
+    resync: bool = False
+
+
+class PostUpdate(Post):
+    id: int
+
+
+class PostBulkCreate(BaseModel):
+    items: conlist(Post, min_items=1, max_items=BULK_MAX_ITEMS)
+
+
+class PostBulkUpdate(BaseModel):
+    items: conlist(PostUpdate, min_items=1, max_items=BULK_MAX_ITEMS)
+
+
+class PostBulkDelete(BaseModel):
+    ids: conlist(int, min_items=1, max_items=BULK_MAX_ITEMS)
+
+
+class PostBulkResult(BaseModel):
+    index: int
+    id: int | None
+    status: str
+    data: PostGet | None = None
+
+
+class PostBulkResponse(BaseModel):
+    items: list[PostBulkResult]
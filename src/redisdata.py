@@ -1,4 +1,37 @@
-import redis
+import asyncio
 
-pool = redis.ConnectionPool(host='localhost', port=6379, db=0)
-connect = redis.Redis(connection_pool=pool)
+from redis import asyncio as aioredis
+
+from src.config import R_HOST, R_PORT, R_DB, R_PASSWORD
+from src.config import R_MAX_CONNECTIONS, R_POOL_TIMEOUT
+from src.metrics import InstrumentedRedis
+
+pool = aioredis.BlockingConnectionPool(host=R_HOST, port=R_PORT, db=R_DB,
+                                       password=R_PASSWORD,
+                                       max_connections=R_MAX_CONNECTIONS,
+                                       timeout=R_POOL_TIMEOUT)
+connect = InstrumentedRedis(connection_pool=pool)
+
+# Lua sources of the app, loaded at startup so their first EVALSHA does
+# not fail with NOSCRIPT and go round again
+scripts: list[str] = []
+
+
+def lua(source: str) -> str:
+    scripts.append(source)
+    return source
+
+
+async def init_redis(connections: int = 1) -> None:
+    """Opens pooled connections before serving requests; the pings run
+    concurrently, so each one takes a connection of its own"""
+    await asyncio.gather(*(connect.ping() for _ in range(connections)))
+    async with connect.pipeline(transaction=False) as pipe:
+        for source in scripts:
+            pipe.script_load(source)
+        await pipe.execute()
+
+
+async def close_redis() -> None:
+    await connect.close()
+    await pool.disconnect()
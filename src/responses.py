@@ -0,0 +1,23 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    """Serializes pydantic models straight to bytes with orjson,
+    so handlers can return them without jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
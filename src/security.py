@@ -1,13 +1,143 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable
+
+from fastapi import HTTPException
 from passlib.context import CryptContext
 
+from src.config import HASH_EXECUTOR, HASH_WORKERS, HASH_QUEUE_LIMIT
+from src.metrics import registry, StatsCollector
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
+def _timed(func: Callable, *args) -> tuple:
+    """Runs inside the worker, so the duration excludes the queue wait"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def _hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def _load_backend() -> None:
+    # passlib loads and self-tests the bcrypt backend on first use
+    pwd_context.handler().get_backend()
+
+
+class HasherMetrics:
+    """Counters of the hashing pool, split into queue wait and hash time"""
+
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.queue_wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+
+    def observe(self, queue_wait: float, hash_time: float) -> None:
+        self.calls += 1
+        self.queue_wait_seconds += queue_wait
+        self.hash_seconds += hash_time
+        self.max_queue_wait_seconds = max(self.max_queue_wait_seconds,
+                                          queue_wait)
+
+    def as_dict(self) -> dict:
+        return {
+            "executor": HASH_EXECUTOR,
+            "workers": HASH_WORKERS,
+            "queue_limit": HASH_QUEUE_LIMIT,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "queue_wait_seconds": self.queue_wait_seconds,
+            "hash_seconds": self.hash_seconds,
+            "max_queue_wait_seconds": self.max_queue_wait_seconds,
+        }
+
+
 class Hasher:
+    """Bcrypt hashing. The async methods run in a bounded worker pool
+    so a login burst does not freeze the event loop"""
+
+    metrics = HasherMetrics()
+    _executor: Executor | None = None
+
     @staticmethod
     def get_hash_password(password: str) -> str:
-        return pwd_context.hash(password)
+        return _hash_password(password)
 
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
-        return pwd_context.verify(plain_password, hashed_password)
+        return _verify_password(plain_password, hashed_password)
+
+    @staticmethod
+    async def get_hash_password_async(password: str) -> str:
+        return await Hasher._run(_hash_password, password)
+
+    @staticmethod
+    async def verify_password_async(plain_password: str,
+                                    hashed_password: str) -> bool:
+        return await Hasher._run(_verify_password,
+                                 plain_password, hashed_password)
+
+    @staticmethod
+    def executor() -> Executor:
+        if Hasher._executor is None:
+            if HASH_EXECUTOR == "process":
+                Hasher._executor = ProcessPoolExecutor(
+                    max_workers=HASH_WORKERS)
+            else:
+                Hasher._executor = ThreadPoolExecutor(
+                    max_workers=HASH_WORKERS,
+                    thread_name_prefix="hasher")
+        return Hasher._executor
+
+    @staticmethod
+    async def warm_up() -> None:
+        """Starts the workers and loads bcrypt in them ahead of the
+        first login"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(Hasher.executor(), _load_backend)
+            for _ in range(HASH_WORKERS)))
+
+    @staticmethod
+    def shutdown() -> None:
+        if Hasher._executor is not None:
+            Hasher._executor.shutdown(wait=True)
+            Hasher._executor = None
+
+    @staticmethod
+    async def _run(func: Callable, *args):
+        metrics = Hasher.metrics
+        if metrics.in_flight >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+            metrics.rejected += 1
+            raise HTTPException(status_code=429, detail={
+                "status": "Too Many Requests",
+                "data": None,
+                "detail": "Try again later"
+            }, headers={"Retry-After": "1"})
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            result, hash_time = await loop.run_in_executor(
+                Hasher.executor(), _timed, func, *args)
+        finally:
+            metrics.in_flight -= 1
+        metrics.observe(queue_wait=time.perf_counter() - start - hash_time,
+                        hash_time=hash_time)
+        return result
+
+
+registry.register(StatsCollector("hasher", "Password hashing pool",
+                                 lambda: Hasher.metrics.as_dict()))
@@ -1,11 +1,25 @@
+import time
+import uuid
+from logging import getLogger
 from typing import Union
 
+from fastapi import HTTPException
+from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import update, and_
 
-from src.user.schemas import UserGet, UserCreate
+from src.user.schemas import UserGet, UserCreate, DeactivationJob
 from src.user.models import User
 from src.security import Hasher
+from src.authorization.crud import AuthRedis
+from src.authorization.cache import UserLookupCache, UserRecord
+from src.post.crud import PostBL
+from src.database import async_session_maker
+from src.redisdata import connect as redis_session
+from src.config import DEACTIVATION_BATCH_SIZE, DEACTIVATION_JOB_TTL
+from src.config import DEACTIVATION_STALE_SECONDS
+
+logger = getLogger(__name__)
 
 
 class UserDB:
@@ -20,38 +34,147 @@ class UserDB:
         await self.session.flush()
         return new_user
 
-    async def delete_user(self, user_id: int) -> Union[int, None]:
+    async def delete_user(self, user_id: int) -> Union[User, None]:
         stmt = (update(User)
                 .where(and_(User.id == user_id, User.is_active == True))
                 .values(is_active=False)
-                .returning(User.id))
-        result = await self.session.execute(stmt)
-        deleted_user_id_row = result.first()
-        if deleted_user_id_row is not None:
-            return deleted_user_id_row[0]
+                .returning(User))
+        return await self.session.scalar(stmt)
 
     async def update_user(self, user_id: int) -> Union[int, None]:
         pass
 
+    async def get_user(self, user_id: int) -> User | None:
+        return await self.session.get(User, user_id)
+
+
+class DeactivationJobs:
+    """Progress of deactivation jobs, kept in a Redis hash per job.
+
+    Every write stamps heartbeat_at. A queued or running job without a
+    heartbeat for DEACTIVATION_STALE_SECONDS lost its worker and reads
+    as "stale"; deactivating the user again starts a new job"""
+
+    prefix = "deactivation:"
+
+    def __init__(self, session: Redis = redis_session):
+        self.database = session
+
+    @staticmethod
+    def job_key(job_id: str) -> str:
+        return f"{DeactivationJobs.prefix}{job_id}"
+
+    async def update(self, job_id: str, **fields) -> None:
+        async with self.database.pipeline(transaction=False) as pipe:
+            pipe.hset(self.job_key(job_id),
+                      mapping={**fields, "heartbeat_at": time.time()})
+            pipe.expire(self.job_key(job_id), DEACTIVATION_JOB_TTL)
+            await pipe.execute()
+
+    async def add_posts_deleted(self, job_id: str, count: int) -> None:
+        async with self.database.pipeline(transaction=False) as pipe:
+            pipe.hincrby(self.job_key(job_id), "posts_deleted", count)
+            pipe.hset(self.job_key(job_id), "heartbeat_at", time.time())
+            await pipe.execute()
+
+    async def get(self, job_id: str) -> DeactivationJob | None:
+        data = await self.database.hgetall(self.job_key(job_id))
+        if data:
+            job = DeactivationJob(
+                job_id=job_id,
+                **{key.decode(): value.decode()
+                   for key, value in data.items()})
+            if job.state in ("queued", "running") and \
+                    (job.heartbeat_at or job.created_at) < \
+                    time.time() - DEACTIVATION_STALE_SECONDS:
+                job.state = "stale"
+            return job
+
 
 class UserBL:
     """The business logic for routers, uses functions from UserDB"""
 
     @staticmethod
     async def create_user(body: UserCreate, session: AsyncSession) -> UserGet:
+        password = await Hasher.get_hash_password_async(body.password)
         async with session.begin():
             userdb = UserDB(session=session)
             user = await userdb.create_user(email=body.email,
                                             username=body.username,
-                                            password=Hasher.get_hash_password(body.password))
-            return UserGet(
-                id=user.id,
-                username=user.username,
-                email=user.email,
-                is_active=user.is_active,
-                is_admin=user.is_admin,
-            )
+                                            password=password)
+            record = UserRecord.of(user)
+        # Replaces a cached miss for the name once the user is committed
+        await UserLookupCache().put(record)
+        return UserGet(
+            id=record.id,
+            username=record.username,
+            email=record.email,
+            is_active=record.is_active,
+            is_admin=record.is_admin,
+        )
 
     @staticmethod
-    async def delete_user():
-        pass
+    async def delete_user(user_id: int, current_user_id: int,
+                          is_admin: bool, session: AsyncSession) -> str:
+        """Deactivates the user at once and returns the id of the job
+        that has to run the cascade, see run_deactivation"""
+        if user_id != current_user_id and is_admin is not True:
+            raise HTTPException(status_code=403, detail={
+                "status": "Access denied",
+                "data": None,
+                "detail": "Forbidden"
+            })
+        async with session.begin():
+            userdb = UserDB(session=session)
+            # An inactive user still gets a job, so a failed cascade can
+            # simply be requested again
+            user = await userdb.delete_user(user_id) or \
+                await userdb.get_user(user_id)
+            if user is None:
+                raise HTTPException(status_code=400, detail={
+                    "status": "Incorrect request",
+                    "data": None,
+                    "detail": 'does not exist'
+                })
+            record = UserRecord.of(user)
+        await UserLookupCache().put(record)
+        job_id = uuid.uuid4().hex
+        await DeactivationJobs().update(job_id, user_id=user_id,
+                                        state="queued",
+                                        sessions_revoked=0, posts_deleted=0,
+                                        created_at=time.time())
+        return job_id
+
+    @staticmethod
+    async def run_deactivation(job_id: str, user_id: int) -> None:
+        """Revokes every session of the user, then deletes the posts in
+        batches of DEACTIVATION_BATCH_SIZE, each in its own transaction"""
+        jobs = DeactivationJobs()
+        await jobs.update(job_id, state="running", started_at=time.time())
+        try:
+            revoked = await AuthRedis().revoke_user_sessions(user_id)
+            await jobs.update(job_id, sessions_revoked=revoked)
+            async with async_session_maker() as session:
+                while deleted := await PostBL.delete_author_posts(
+                        author_id=user_id, session=session,
+                        limit=DEACTIVATION_BATCH_SIZE):
+                    await jobs.add_posts_deleted(job_id, deleted)
+        except Exception as err:
+            logger.exception("Deactivation job %s failed", job_id)
+            await jobs.update(job_id, state="failed", error=str(err),
+                              finished_at=time.time())
+        else:
+            await jobs.update(job_id, state="done", finished_at=time.time())
+
+    @staticmethod
+    async def get_deactivation(job_id: str, current_user_id: int,
+                               is_admin: bool) -> DeactivationJob:
+        job = await DeactivationJobs().get(job_id)
+        if job is None or (job.user_id != current_user_id
+                           and is_admin is not True):
+            raise HTTPException(status_code=400, detail={
+                "status": "Incorrect request",
+                "data": None,
+                "detail": 'does not exist'
+            })
+        return job
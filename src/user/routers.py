@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi import Header, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from logging import getLogger
 
 from src.user.schemas import UserCreate, UserGet
 from src.user.crud import UserBL
-from src.database import get_db
+from src.database import get_db, get_read_db
+from src.config import PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT
+from src.post.routers import post_page_response
+from src.post.schemas import PostView
+from src.authorization.crud import Token
+from src.authorization.schemas import TokenData
 
 
 logger = getLogger(__name__)
@@ -21,3 +27,45 @@ async def create_user(body: UserCreate,
     except IntegrityError as err:
         logger.error(err)
         raise HTTPException(status_code=503, detail=f"Database error: {err}")
+
+
+@app.post("/{user_id}/deactivate", status_code=202)
+async def deactivate_user(user_id: int, request: Request,
+                          background_tasks: BackgroundTasks,
+                          user: TokenData = Depends(Token.get_current_user),
+                          session: AsyncSession = Depends(get_db)):
+    job_id = await UserBL.delete_user(user_id=user_id,
+                                      current_user_id=user.id,
+                                      is_admin=user.is_admin,
+                                      session=session)
+    background_tasks.add_task(UserBL.run_deactivation, job_id, user_id)
+    return Token.response(body_response={
+        "status": "Accepted",
+        "data": {"job_id": job_id},
+        "detail": f"/user/deactivations/{job_id}"
+    }, body_token=request.state.token_response, status_code=202)
+
+
+@app.get("/deactivations/{job_id}")
+async def get_deactivation(job_id: str, request: Request,
+                           user: TokenData = Depends(Token.get_current_user)):
+    job = await UserBL.get_deactivation(job_id=job_id,
+                                        current_user_id=user.id,
+                                        is_admin=user.is_admin)
+    return Token.response(body_response=job,
+                          body_token=request.state.token_response)
+
+
+@app.get("/{user_id}/posts")
+async def get_user_posts(user_id: int, request: Request,
+                         limit: int = Query(PAGE_DEFAULT_LIMIT, ge=1,
+                                            le=PAGE_MAX_LIMIT),
+                         after: str | None = None,
+                         view: PostView = "full",
+                         if_none_match: str | None = Header(None),
+                         user: TokenData = Depends(Token.get_current_user),
+                         session: AsyncSession = Depends(get_read_db)):
+    return await post_page_response(
+        request=request, user=user, session=session, limit=limit,
+        after=after, view=view, if_none_match=if_none_match,
+        author_id=user_id)
@@ -19,3 +19,16 @@ class UserGet(User):
 
     class Config:
         orm_mode = True
+
+
+class DeactivationJob(BaseModel):
+    job_id: str
+    user_id: int
+    state: str
+    sessions_revoked: int
+    posts_deleted: int
+    created_at: float
+    started_at: float | None = None
+    heartbeat_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
@@ -0,0 +1,8 @@
+import pytest
+from fakeredis import aioredis
+
+
+@pytest.fixture
+def redis():
+    """A fresh in-memory Redis; tests drive it with asyncio.run"""
+    return aioredis.FakeRedis()
@@ -0,0 +1,51 @@
+from src.budgets import Budget, BudgetChecker
+from src.metrics import RequestStats
+
+BUDGETS = {("GET", "/tasks/{task_id}"): Budget(sql=1, redis=1)}
+
+
+def stats(sql: int, redis: int) -> RequestStats:
+    return RequestStats(db_queries=sql, redis_commands=redis,
+                        statements=[f"SQL SELECT {i}" for i in range(sql)])
+
+
+def test_within_budget_is_not_reported():
+    checker = BudgetChecker(BUDGETS, enabled=True)
+    checker.check("GET", "/tasks/{task_id}", stats(1, 1))
+    checker.check("GET", "/tasks/{task_id}", stats(0, 0))
+    assert checker.offenders == {}
+    assert checker.report() == ""
+
+
+def test_over_budget_keeps_the_worst_request_and_the_count():
+    checker = BudgetChecker(BUDGETS, enabled=True)
+    checker.check("GET", "/tasks/{task_id}", stats(2, 1))
+    checker.check("GET", "/tasks/{task_id}", stats(3, 1))
+    checker.check("GET", "/tasks/{task_id}", stats(1, 2))
+    worst, count = checker.offenders[("GET", "/tasks/{task_id}")]
+    assert count == 3
+    assert worst.stats.db_queries == 3
+    report = checker.report()
+    assert "GET /tasks/{task_id}: 3 SQL, 1 Redis, budget 1 SQL, 1 Redis" \
+        in report
+    assert "SQL SELECT 2" in report
+    assert "(3 requests)" in report
+
+
+def test_route_without_budget_is_reported():
+    checker = BudgetChecker(BUDGETS, enabled=True)
+    checker.check("POST", "/tasks", stats(0, 0))
+    assert "POST /tasks: 0 SQL, 0 Redis, no budget" in checker.report()
+
+
+def test_unmatched_requests_are_ignored():
+    checker = BudgetChecker(BUDGETS, enabled=True)
+    checker.check("GET", "unmatched", stats(5, 5))
+    assert checker.offenders == {}
+
+
+def test_reset_clears_the_offenders():
+    checker = BudgetChecker(BUDGETS, enabled=True)
+    checker.check("GET", "/tasks/{task_id}", stats(2, 2))
+    checker.reset()
+    assert checker.offenders == {}
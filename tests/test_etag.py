@@ -0,0 +1,33 @@
+import pytest
+
+from src.etag import make_etag, etag_matches
+
+ETAG = make_etag("post", 1, 3, True)
+
+
+def test_etag_is_strong_and_stable():
+    assert ETAG.startswith('"') and ETAG.endswith('"')
+    assert ETAG == make_etag("post", 1, 3, True)
+    assert ETAG != make_etag("post", 1, 4, True)
+
+
+@pytest.mark.parametrize("if_none_match", [
+    ETAG,
+    f"W/{ETAG}",
+    f'"other", {ETAG}',
+    f'"other",W/{ETAG}',
+    "*",
+    " * ",
+])
+def test_matching_tags(if_none_match):
+    assert etag_matches(if_none_match, ETAG)
+
+
+@pytest.mark.parametrize("if_none_match", [
+    '"other"',
+    ETAG.strip('"'),
+    '"a", "b"',
+    "",
+])
+def test_other_tags(if_none_match):
+    assert not etag_matches(if_none_match, ETAG)
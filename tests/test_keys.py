@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from jose import jwt, JWTError
+
+from src.authorization import crud
+from src.authorization.crud import Token, VerifiedTokenCache
+from src.authorization.keys import KeyRing, KEY_ALGORITHM
+from src.config import ConfigError, SECRET_KEY, ALGORITHM
+
+
+def write_key(directory, kid: str, public: bool = False):
+    key = ec.generate_private_key(ec.SECP256R1())
+    if public:
+        pem = key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo)
+    else:
+        pem = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    (directory / f"{kid}.pem").write_bytes(pem)
+
+
+@pytest.fixture
+def ring(tmp_path, monkeypatch):
+    write_key(tmp_path, "2024-01")
+    write_key(tmp_path, "2024-02")
+    write_key(tmp_path, "old", public=True)
+    ring = KeyRing()
+    ring.load(str(tmp_path), active_kid=None, accept_hmac=False)
+    monkeypatch.setattr(crud, "key_ring", ring)
+    monkeypatch.setattr(Token, "verified", VerifiedTokenCache(size=16))
+    return ring
+
+
+def token(claims: dict, key, algorithm: str, headers=None) -> str:
+    return jwt.encode(claims, key, algorithm, headers=headers)
+
+
+def claims(**extra) -> dict:
+    return {"user_id": 1, "username": "alice", "is_admin": False,
+            "exp": datetime.now(timezone.utc) + timedelta(minutes=5),
+            **extra}
+
+
+def test_the_last_private_key_signs(ring):
+    assert ring.signing_key().kid == "2024-02"
+    assert ring.signing_key().algorithm == KEY_ALGORITHM
+
+
+def test_jwks_lists_every_public_key(ring):
+    keys = {key["kid"]: key for key in ring.jwks()["keys"]}
+    assert set(keys) == {"2024-01", "2024-02", "old"}
+    for key in keys.values():
+        assert key["kty"] == "EC"
+        assert key["crv"] == "P-256"
+        assert key["use"] == "sig"
+        assert "d" not in key
+
+
+def test_active_kid_must_be_a_private_key(tmp_path):
+    write_key(tmp_path, "a")
+    write_key(tmp_path, "b", public=True)
+    with pytest.raises(ConfigError):
+        KeyRing().load(str(tmp_path), active_kid="b")
+    with pytest.raises(ConfigError):
+        KeyRing().load(str(tmp_path / "missing"))
+
+
+def test_invalid_key_file_is_a_config_error(tmp_path):
+    (tmp_path / "bad.pem").write_text("not a key")
+    with pytest.raises(ConfigError):
+        KeyRing().load(str(tmp_path))
+
+
+def test_signed_token_round_trips(ring):
+    access = Token.create_access_token(crud.UserGet(
+        id=1, username="alice", email="alice@example.com", is_active=True,
+        is_admin=False))
+    assert jwt.get_unverified_header(access)["kid"] == "2024-02"
+    assert Token.decode_token(access).username == "alice"
+
+
+def test_unknown_kid_is_rejected(ring):
+    signing = ring.signing_key()
+    forged = token(claims(), signing.key.to_pem().decode(), KEY_ALGORITHM,
+                   headers={"kid": "nope"})
+    with pytest.raises(JWTError):
+        Token.decode_token(forged)
+
+
+@pytest.mark.parametrize("kid", [["2024-02"], {"a": 1}, 7])
+def test_kid_of_another_type_is_rejected(ring, kid):
+    signing = ring.signing_key()
+    forged = token(claims(), signing.key.to_pem().decode(), KEY_ALGORITHM,
+                   headers={"kid": kid})
+    with pytest.raises(JWTError):
+        Token.decode_token(forged)
+
+
+def test_token_without_exp_is_rejected(ring):
+    signing = ring.signing_key()
+    data = claims()
+    del data["exp"]
+    unbounded = token(data, signing.key.to_pem().decode(), KEY_ALGORITHM,
+                      headers={"kid": signing.kid})
+    with pytest.raises(JWTError):
+        Token.decode_token(unbounded)
+
+
+@pytest.mark.skipif(not (SECRET_KEY and ALGORITHM),
+                    reason="needs SECRET_KEY_TOKEN and ALGORITHM")
+def test_hmac_tokens_need_the_flag_next_to_the_ring(ring, tmp_path):
+    legacy = token(claims(), SECRET_KEY, ALGORITHM)
+    with pytest.raises(JWTError):
+        Token.decode_token(legacy)
+    ring.load(str(tmp_path), active_kid=None, accept_hmac=True)
+    assert Token.decode_token(legacy).id == 1
@@ -0,0 +1,37 @@
+import pytest
+from fastapi import HTTPException
+
+from src.pagination import encode_cursor, decode_cursor
+
+
+def test_cursor_round_trips():
+    cursor = encode_cursor(id=42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, id=int) == {"id": 42}
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not base64!",
+    encode_cursor(id="42"),
+    encode_cursor(other=1),
+    encode_cursor(id=42)[:-2],
+    "W10",  # a JSON list, not an object
+])
+def test_tampered_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, id=int)
+    assert error.value.status_code == 400
+    assert error.value.detail["detail"] == "Invalid cursor"
+
+
+def test_search_cursor_keeps_the_rank_exact():
+    rank = 0.0607927106320858
+    cursor = decode_cursor(encode_cursor(rank=rank, id=7), rank=float,
+                           id=int)
+    assert cursor == {"rank": rank, "id": 7}
+
+
+def test_search_cursor_needs_a_float_rank():
+    with pytest.raises(HTTPException):
+        decode_cursor(encode_cursor(rank="0.5", id=7), rank=float, id=int)
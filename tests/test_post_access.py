@@ -0,0 +1,50 @@
+from fastapi import HTTPException
+
+from src.post.crud import PostBL
+
+
+def statuses(results) -> list:
+    return [result and result.status for result in results]
+
+
+def test_bulk_access_splits_owned_from_rejected_ids():
+    authors = {1: 10, 2: 20, 3: 10}
+    results = PostBL._check_bulk_access([1, 2, 4, 3, 1], authors,
+                                        user_id=10, is_admin=False)
+    assert statuses(results) == [None, "forbidden", "not_found", None,
+                                 "duplicate"]
+    assert [result.index for result in results if result] == [1, 2, 4]
+
+
+def test_admin_may_write_every_existing_post():
+    results = PostBL._check_bulk_access([1, 2, 4], {1: 10, 2: 20},
+                                        user_id=99, is_admin=True)
+    assert statuses(results) == [None, None, "not_found"]
+
+
+class Row:
+    def __init__(self, id, target_author_id):
+        self.id = id
+        self.target_author_id = target_author_id
+
+
+def status_of(row, user_id: int = 10, is_admin: bool = False) -> int | None:
+    try:
+        PostBL._check_modified(row, user_id, is_admin)
+    except HTTPException as error:
+        return error.status_code
+    return None
+
+
+def test_modified_row_passes():
+    assert status_of(Row(id=1, target_author_id=10)) is None
+
+
+def test_someone_elses_post_is_forbidden():
+    assert status_of(Row(id=None, target_author_id=20)) == 403
+    assert status_of(Row(id=None, target_author_id=20), is_admin=True) == 400
+
+
+def test_missing_or_concurrently_deleted_post_does_not_exist():
+    assert status_of(None) == 400
+    assert status_of(Row(id=None, target_author_id=10)) == 400
@@ -0,0 +1,45 @@
+import asyncio
+
+from src.post import cache
+from src.post.cache import PostCache, PageETags
+
+
+def test_fill_beyond_the_limit_evicts_the_oldest_entries(redis, monkeypatch):
+    monkeypatch.setattr(cache, "POST_CACHE_MAX_ENTRIES", 2)
+    posts = PostCache(session=redis)
+
+    async def scenario():
+        for post_id in (1, 2, 3):
+            await posts.set(post_id, {"id": post_id}, generation=0)
+        return ([await redis.exists(posts.entry_key(post_id))
+                 for post_id in (1, 2, 3)],
+                await redis.zrange(posts.index_key(), 0, -1))
+
+    assert asyncio.run(scenario()) == ([0, 1, 1], [b"2", b"3"])
+
+
+def test_entry_of_an_older_generation_is_a_miss(redis):
+    posts = PostCache(session=redis)
+
+    async def scenario():
+        await posts.set(1, {"id": 1}, generation=0)
+        hit = await posts.get(1)
+        await posts.invalidate(1)
+        return hit, await posts.get(1)
+
+    assert asyncio.run(scenario()) == (({"id": 1}, 0), (None, 1))
+
+
+def test_page_etag_is_likely_current_until_its_scope_changes():
+    PageETags.forget_all()
+    feed, everything = (1, False, 50, None, "full", 7), \
+        (1, False, 50, None, "full", None)
+    PageETags.remember(feed, 7, '"a"')
+    PageETags.remember(everything, None, '"b"')
+    assert PageETags.likely_current(feed, 7, 'W/"a"')
+    assert not PageETags.likely_current(feed, 7, '"other"')
+    PageETags.changed(8)
+    assert PageETags.likely_current(feed, 7, '"a"')
+    assert not PageETags.likely_current(everything, None, '"b"')
+    PageETags.changed(7)
+    assert not PageETags.likely_current(feed, 7, '"a"')
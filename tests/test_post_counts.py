@@ -0,0 +1,50 @@
+import asyncio
+
+from src.post.cache import AuthorPostCounts
+
+
+def test_miss_is_loaded_once_then_adjusted(redis):
+    counts = AuthorPostCounts(session=redis)
+    loads = []
+
+    async def loader() -> int:
+        loads.append(1)
+        return 7
+
+    async def scenario():
+        assert await counts.get_or_load(1, loader) == 7
+        await counts.adjust({1: 2})
+        return await counts.get_or_load(1, loader)
+
+    assert asyncio.run(scenario()) == 9
+    assert len(loads) == 1
+
+
+def test_write_during_the_load_is_not_lost(redis):
+    counts = AuthorPostCounts(session=redis)
+
+    async def stale_loader() -> int:
+        # A post is deleted after the count was read, before it is stored
+        await counts.adjust({1: -1})
+        return 7
+
+    async def fresh_loader() -> int:
+        return 6
+
+    async def scenario():
+        assert await counts.get_or_load(1, stale_loader) == 7
+        return await counts.get_or_load(1, fresh_loader)
+
+    assert asyncio.run(scenario()) == 6
+
+
+def test_adjust_leaves_missing_counts_missing(redis):
+    counts = AuthorPostCounts(session=redis)
+
+    async def scenario():
+        await redis.set(counts.count_key(1), 10)
+        await counts.adjust({1: -3, 2: 5, 3: 0})
+        return (await redis.get(counts.count_key(1)),
+                await redis.get(counts.count_key(2)))
+
+    assert asyncio.run(scenario()) == (b"7", None)
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.authorization import ratelimit
+from src.authorization.ratelimit import LoginRateLimiter
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(ratelimit, "LOGIN_RATE_WINDOW", 60)
+    monkeypatch.setattr(ratelimit, "LOGIN_RATE_PER_IP", 3)
+    monkeypatch.setattr(ratelimit, "LOGIN_RATE_PER_USERNAME", 2)
+
+
+async def attempts(limiter: LoginRateLimiter,
+                   *calls: tuple[str, str]) -> list[int | None]:
+    results = []
+    for ip, username in calls:
+        try:
+            await limiter.check(ip, username)
+            results.append(None)
+        except HTTPException as error:
+            results.append(int(error.headers["Retry-After"]))
+    return results
+
+
+def test_username_limit_applies_across_ips(redis, limits):
+    limiter = LoginRateLimiter(session=redis)
+    results = asyncio.run(attempts(limiter, ("1.1.1.1", "alice"),
+                                   ("2.2.2.2", "alice"),
+                                   ("3.3.3.3", "alice")))
+    assert results[:2] == [None, None]
+    assert 0 < results[2] <= 60
+
+
+def test_ip_limit_applies_across_usernames(redis, limits):
+    limiter = LoginRateLimiter(session=redis)
+    results = asyncio.run(attempts(limiter, *(("1.1.1.1", name)
+                                              for name in "abcd")))
+    assert results[:3] == [None, None, None]
+    assert results[3] is not None
+
+
+def test_rejected_attempt_is_not_counted(redis, limits):
+    limiter = LoginRateLimiter(session=redis)
+
+    async def scenario():
+        await attempts(limiter, *(("1.1.1.1", "alice"),) * 4)
+        return await redis.zcard(f"{limiter.prefix}ip:1.1.1.1")
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_zero_limit_turns_the_key_off(redis, limits, monkeypatch):
+    monkeypatch.setattr(ratelimit, "LOGIN_RATE_PER_USERNAME", 0)
+    limiter = LoginRateLimiter(session=redis)
+    results = asyncio.run(attempts(limiter, *((f"10.0.0.{index}", "alice")
+                                              for index in range(5))))
+    assert results == [None] * 5
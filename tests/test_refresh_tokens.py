@@ -0,0 +1,57 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from src.authorization.crud import AuthRedis
+
+EXPIRE = timedelta(days=1)
+
+
+async def login(auth: AuthRedis, user_id: int = 1) -> str:
+    token = auth.new_refresh_token(user_id)
+    await auth.set_refresh_token(token, '{"id": 1}', EXPIRE)
+    return token
+
+
+def test_racing_refreshes_get_the_same_pair(redis):
+    auth = AuthRedis(session=redis)
+
+    async def scenario():
+        token = await login(auth)
+        first = await auth.rotate_refresh_token(token, EXPIRE)
+        second = await auth.rotate_refresh_token(token, EXPIRE)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second
+    assert first[1] == b'{"id": 1}'
+
+
+def test_grace_pair_is_dropped_with_its_session(redis):
+    auth = AuthRedis(session=redis)
+
+    async def scenario():
+        token = await login(auth)
+        new_token, _ = await auth.rotate_refresh_token(token, EXPIRE)
+        await auth.delete_refresh_token(new_token)
+        await auth.rotate_refresh_token(token, EXPIRE)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(scenario())
+    assert error.value.status_code == 401
+
+
+def test_revoke_deletes_every_token_of_the_user(redis):
+    auth = AuthRedis(session=redis)
+
+    async def scenario():
+        tokens = [await login(auth) for _ in range(3)]
+        other = await login(auth, user_id=2)
+        revoked = await auth.revoke_user_sessions(1)
+        left = [await redis.exists(auth.refresh_key(token))
+                for token in tokens]
+        return revoked, left, await redis.exists(auth.refresh_key(other))
+
+    assert asyncio.run(scenario()) == (3, [0, 0, 0], 1)
@@ -0,0 +1,74 @@
+import asyncio
+
+from src import database
+from src.database import ReplicaRouter
+
+
+class FakeEngine:
+    """Stands in for a replica engine, counting connection attempts"""
+
+    def __init__(self, up: bool, delay: float = 0):
+        self.up = up
+        self.delay = delay
+        self.attempts = 0
+
+    def connect(self):
+        return FakeConnect(self)
+
+
+class FakeConnect:
+    def __init__(self, engine: FakeEngine):
+        self.engine = engine
+
+    async def _open(self):
+        self.engine.attempts += 1
+        await asyncio.sleep(self.engine.delay)
+        if not self.engine.up:
+            raise ConnectionRefusedError("down")
+        return self
+
+    def __await__(self):
+        return self._open().__await__()
+
+    async def __aenter__(self):
+        return await self._open()
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def router(*engines: FakeEngine) -> ReplicaRouter:
+    replicas = ReplicaRouter([])
+    replicas.engines = list(engines)
+    replicas.ejected_until = [0.0] * len(engines)
+    replicas.probing = [asyncio.Lock() for _ in engines]
+    return replicas
+
+
+def test_dead_replica_is_skipped_at_checkout():
+    dead, alive = FakeEngine(up=False), FakeEngine(up=True)
+    replicas = router(dead, alive)
+    index, connection = asyncio.run(replicas.connect())
+    assert index == 1 and connection is not None
+    assert replicas.ejected_until[0] > 0
+
+
+def test_primary_serves_when_every_replica_is_down():
+    replicas = router(FakeEngine(up=False), FakeEngine(up=False))
+    assert asyncio.run(replicas.connect()) == (None, None)
+    assert all(replicas.ejected_until)
+
+
+def test_ejected_replica_is_probed_once(monkeypatch):
+    monkeypatch.setattr(database, "DB_REPLICA_EJECT_SECONDS", 0)
+    replica = FakeEngine(up=True, delay=0.01)
+    replicas = router(replica)
+
+    async def scenario():
+        replicas.eject(0)
+        return await asyncio.gather(*(replicas.choose() for _ in range(5)))
+
+    chosen = asyncio.run(scenario())
+    assert replica.attempts == 1
+    assert chosen.count(0) >= 1
+    assert replicas.ejected_until[0] == 0.0
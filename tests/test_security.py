@@ -0,0 +1,46 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from src import security
+from src.security import Hasher, HasherMetrics
+
+
+def test_full_pool_turns_callers_away(monkeypatch):
+    monkeypatch.setattr(security, "HASH_WORKERS", 1)
+    monkeypatch.setattr(security, "HASH_QUEUE_LIMIT", 1)
+    monkeypatch.setattr(Hasher, "metrics", HasherMetrics())
+    monkeypatch.setattr(Hasher, "_executor", None)
+    release = threading.Event()
+
+    def slow(value: str) -> str:
+        release.wait(5)
+        return value
+
+    async def scenario():
+        running = [asyncio.ensure_future(Hasher._run(slow, str(index)))
+                   for index in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as error:
+            await Hasher._run(slow, "third")
+        release.set()
+        return error.value, await asyncio.gather(*running)
+
+    try:
+        error, results = asyncio.run(scenario())
+    finally:
+        Hasher.shutdown()
+    assert error.status_code == 429
+    assert error.headers == {"Retry-After": "1"}
+    assert results == ["0", "1"]
+    assert Hasher.metrics.rejected == 1
+    assert Hasher.metrics.calls == 2
+    assert Hasher.metrics.in_flight == 0
+
+
+def test_hash_round_trips():
+    hashed = Hasher.get_hash_password("secret")
+    assert Hasher.verify_password("secret", hashed)
+    assert not Hasher.verify_password("other", hashed)
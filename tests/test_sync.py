@@ -0,0 +1,161 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from src.pagination import encode_cursor, decode_cursor
+from src.post import crud, events
+from src.post.cache import PageETags
+from src.post.crud import PostBL, PostDB, _to_micros
+from src.post.events import EventHub, PostEvents, _stream_position
+
+T0 = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def post(id: int, seconds: int):
+    return SimpleNamespace(id=id, title="t", text="x", author_id=1,
+                           version=1, updated_at=T0 + timedelta(seconds=seconds))
+
+
+def tombstone(post_id: int, seconds: int):
+    return SimpleNamespace(post_id=post_id,
+                           deleted_at=T0 + timedelta(seconds=seconds))
+
+
+class FakeSession:
+    @asynccontextmanager
+    async def begin(self):
+        yield self
+
+
+def test_streams_merge_oldest_first_post_before_tombstone():
+    positions = {"p": None, "d": None}
+    items = PostBL._merge_changes([post(1, 0), post(2, 5)],
+                                  [tombstone(3, 5), tombstone(4, 1)],
+                                  positions, limit=10)
+    assert [(item.id, item.op) for item in items] == [
+        (1, "upsert"), (4, "delete"), (2, "upsert"), (3, "delete")]
+    assert positions == {"p": (T0 + timedelta(seconds=5), 2),
+                         "d": (T0 + timedelta(seconds=5), 3)}
+
+
+def test_positions_stop_at_the_limit():
+    positions = {"p": None, "d": None}
+    items = PostBL._merge_changes([post(1, 0), post(2, 5)],
+                                  [tombstone(3, 1)], positions, limit=2)
+    assert [item.id for item in items] == [1, 3]
+    # The post left out is read again from the next cursor
+    assert positions["p"] == (T0, 1)
+
+
+def test_changes_stop_short_of_the_settle_window(monkeypatch):
+    seen = {}
+
+    async def changed(self, author_id, before, after, limit):
+        seen["before"] = before
+        return [post(1, 0)]
+
+    async def tombstones(self, author_id, before, after, limit):
+        return []
+
+    monkeypatch.setattr(PostDB, "get_changed_posts", changed)
+    monkeypatch.setattr(PostDB, "get_tombstones", tombstones)
+    page = asyncio.run(PostBL.get_changes(author_id=1,
+                                          session=FakeSession(), limit=10))
+    before = seen["before"].compile()
+    assert str(before).startswith("now() -")
+    assert list(before.params.values()) == [
+        timedelta(seconds=crud.SYNC_SETTLE_SECONDS)]
+    assert [item.id for item in page.items] == [1]
+    assert not page.resync
+
+
+def test_cursor_older_than_the_tombstones_asks_for_a_resync(monkeypatch):
+    monkeypatch.setattr(crud, "SYNC_TOMBSTONE_TTL", 3600)
+    synced_at = datetime.now(timezone.utc) - timedelta(hours=2)
+    since = encode_cursor(s=_to_micros(synced_at), p=[], d=[])
+    # The session is never touched on this path
+    page = asyncio.run(PostBL.get_changes(author_id=1, session=None,
+                                          limit=10, since=since))
+    assert page.resync and page.items == [] and page.has_more
+    assert decode_cursor(page.next_cursor, p=list, d=list)["p"] == []
+
+
+def test_cursor_inside_the_retention_window_syncs(monkeypatch):
+    monkeypatch.setattr(crud, "SYNC_TOMBSTONE_TTL", 3600)
+
+    async def nothing(self, author_id, before, after, limit):
+        return []
+
+    monkeypatch.setattr(PostDB, "get_changed_posts", nothing)
+    monkeypatch.setattr(PostDB, "get_tombstones", nothing)
+    synced_at = datetime.now(timezone.utc) - timedelta(minutes=59)
+    since = encode_cursor(s=_to_micros(synced_at), p=[], d=[])
+    page = asyncio.run(PostBL.get_changes(author_id=1, session=FakeSession(),
+                                          limit=10, since=since))
+    assert not page.resync
+
+
+def test_stream_positions_compare_as_numbers():
+    assert _stream_position("123-4") == (123, 4)
+    assert _stream_position("123") == (123, 0)
+    assert _stream_position("99-10") < _stream_position("100-0")
+    with pytest.raises(ValueError):
+        _stream_position("abc-1")
+
+
+@pytest.fixture
+def hub():
+    return EventHub(session=None)
+
+
+def test_dispatch_feeds_the_author_subscriptions(hub):
+    mine, theirs = hub.subscribe(1), hub.subscribe(2)
+    before = PageETags.author_generations.get(1, 0)
+    hub.dispatch(b'1 5-0 {"op":"upsert","id":3,"version":2}')
+    assert mine.queue.get_nowait() == \
+        ("5-0", '{"op":"upsert","id":3,"version":2}')
+    assert theirs.queue.empty()
+    assert PageETags.author_generations[1] == before + 1
+
+
+@pytest.mark.parametrize("message", [b"x 5-0 {}", b"1", b"\xff 5-0 {}"])
+def test_malformed_events_are_dropped(hub, message):
+    subscription = hub.subscribe(1)
+    hub.dispatch(message)
+    assert subscription.queue.empty()
+    assert not subscription.lost.is_set()
+
+
+def test_full_queue_marks_the_subscription_lost(hub, monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_QUEUE_SIZE", 1)
+    subscription = hub.subscribe(1)
+    hub.dispatch(b"1 5-0 {}")
+    assert not subscription.lost.is_set()
+    hub.dispatch(b"1 6-0 {}")
+    assert subscription.lost.is_set()
+    hub.unsubscribe(subscription)
+    assert hub.subscriptions == {}
+
+
+def test_replay_after_a_trimmed_position_asks_for_a_reset(redis):
+    async def scenario():
+        feed = PostEvents(session=redis)
+        for version in (1, 2, 3):
+            await feed.publish("upsert", [SimpleNamespace(
+                id=7, author_id=1, version=version)])
+        entries = await redis.xrange(PostEvents.stream_key(1))
+        first, last = entries[0][0].decode(), entries[-1][0].decode()
+        replayed = await feed.replay(1, first)
+        await redis.xtrim(PostEvents.stream_key(1), maxlen=1,
+                          approximate=False)
+        return (replayed, await feed.replay(1, last),
+                await feed.replay(1, first))
+
+    replayed, caught_up, trimmed = asyncio.run(scenario())
+    assert [json.loads(data)["version"] for _, data in replayed] == [2, 3]
+    assert caught_up == []
+    assert trimmed is None
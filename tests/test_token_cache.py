@@ -0,0 +1,27 @@
+import time
+
+from src.authorization.crud import VerifiedTokenCache
+from src.authorization.schemas import TokenData
+
+
+def data(user_id: int) -> TokenData:
+    return TokenData(id=user_id, username=f"user{user_id}", is_admin=False)
+
+
+def test_least_recently_used_token_is_dropped():
+    cache = VerifiedTokenCache(size=2)
+    later = time.time() + 60
+    cache.put("a", data(1), later)
+    cache.put("b", data(2), later)
+    assert cache.get("a").id == 1
+    cache.put("c", data(3), later)
+    assert cache.get("b") is None
+    assert cache.get("a").id == 1
+    assert cache.get("c").id == 3
+
+
+def test_expired_token_is_a_miss_and_removed():
+    cache = VerifiedTokenCache(size=2)
+    cache.put("a", data(1), time.time() - 1)
+    assert cache.get("a") is None
+    assert "a" not in cache.entries